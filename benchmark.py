@@ -0,0 +1,679 @@
+"""
+Load benchmark for the headcount pipeline, run against local stand-in servers.
+
+A synthetic workforce is served by a local HTTP server that answers the same
+endpoints main.py calls: ADP /hr/v2/workers (one tenant per country) and
+Cascade /hr/v2/employees, /jobs and /hierarchy. The server supports OData
+$top/$skip/$filter, the record counts both APIs return, bearer tokens that
+expire, and a per-tenant rate limit that answers 429 with Retry-After.
+
+The full pipeline (pipeline_stages from main.py) then runs against it, and
+the benchmark reports per-stage time, throughput, peak memory and request
+counts. Reports are written to a temporary folder, not Data/.
+
+Usage:
+    python benchmark.py --employees 10000
+    python benchmark.py --employees 500000 --server-rate 100 --json results.json
+
+The server runs in its own process, so the memory figures are the
+pipeline's alone.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, parse_qsl, urlparse
+
+countries = ["usa", "can"]
+
+# Share of the Cascade headcount that is also in each country's ADP tenant
+adp_share = {"usa": 0.15, "can": 0.05}
+
+# Which pipeline stage makes the requests counted under each server route
+route_stages = {
+    "adp-usa token": "adp_setup_usa",
+    "adp-can token": "adp_setup_can",
+    "adp-usa workers": "adp_export_usa",
+    "adp-can workers": "adp_export_can",
+    "cascade token": "cascade_setup",
+    "cascade jobs": "cascade_jobs",
+    "cascade hierarchy": "cascade_hierarchy",
+    "cascade employees": "cascade_headcount",
+    "cascade line managers": "cascade_leavers",
+}
+
+#----------------
+
+def iso(day):
+    return f"{day.isoformat()}T00:00:00Z"
+
+def random_day(rng, start, end):
+    return start + timedelta(days=rng.randrange(max((end - start).days, 1)))
+
+def generate_hierarchy(rng):
+    """
+    Build a six-level hierarchy shaped like the real one.
+
+    Level 2 titles cover every country in payroll_rules.json, and some level 4
+    and level 6 nodes carry the Lemac and Surveyor titles the rules look for.
+
+    Returns:
+        tuple: (list of hierarchy nodes, list of leaf node Ids).
+    """
+    level_2 = [
+        "Acorn Group", "Acorn (UK)", "Acorn USA", "Acorn Canada", "Acorn Germany", "Acorn France",
+        "Acorn Italy", "Acorn South Africa", "Acorn Australia", "Acorn New Zealand",
+        "Acorn Isle of Man", "Acorn Singapore",
+    ]
+    nodes = [{"Id": 1, "Level": 1, "Title": "Acorn", "ParentId": None}]
+    parents = [1]
+    next_id = 2
+
+    for level in range(2, 7):
+        children = []
+        for parent_id in parents:
+            if level == 2:
+                titles = level_2
+            else:
+                titles = [f"Unit {level}.{next_id + i}" for i in range(rng.randint(2, 4))]
+                if level == 3 and rng.random() < 0.1:
+                    titles[0] += " (935)"
+                if level == 4 and rng.random() < 0.1:
+                    titles[0] = f"Lemac {next_id}"
+                if level == 6 and rng.random() < 0.2:
+                    titles[0] = f"Surveyor Team {next_id}"
+            for title in titles:
+                nodes.append({"Id": next_id, "Level": level, "Title": title, "ParentId": parent_id})
+                children.append(next_id)
+                next_id += 1
+        parents = children
+
+    return nodes, parents
+
+def generate_workforce(employees, seed=1):
+    """
+    Generate a synthetic Cascade and ADP workforce.
+
+    About three quarters of the Cascade employees are current, a tenth left
+    this year and the rest left in earlier years or start in the future, so
+    the server-side filters have real work to do. Each employee has one to
+    three jobs, the latest one open, and a line manager picked from the
+    workforce (a few point at Ids that do not exist, to exercise the 404
+    path). Each ADP tenant holds a share of the headcount, mostly active,
+    with some on leave and some terminated.
+
+    Args:
+        employees (int): Number of Cascade employees, e.g. 1000 to 500000.
+        seed (int): Random seed, so runs are repeatable.
+
+    Returns:
+        dict: {"hierarchy", "employees", "jobs", "adp-usa", "adp-can"} lists of records.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    this_year = date(today.year, 1, 1)
+
+    hierarchy, leaves = generate_hierarchy(rng)
+    employee_records = []
+    job_records = []
+
+    for i in range(employees):
+        employee_id = f"emp-{i:07d}"
+        roll = rng.random()
+        if roll < 0.75:
+            start, left = random_day(rng, date(1985, 1, 1), today - timedelta(days=60)), None
+        elif roll < 0.85:
+            start = random_day(rng, date(1990, 1, 1), this_year)
+            left = random_day(rng, this_year, today)
+        elif roll < 0.98:
+            start = random_day(rng, date(1985, 1, 1), date(today.year - 2, 1, 1))
+            left = random_day(rng, start, this_year)
+        else:
+            start, left = random_day(rng, today + timedelta(days=1), today + timedelta(days=90)), None
+
+        employee_records.append({
+            "Id": employee_id,
+            "DisplayId": str(100000 + i),
+            "KnownAs": rng.choice(["Alex", "Sam", "Jo", "Chris", "Pat", "Lee", "Kim", "Robin"]),
+            "LastName": rng.choice(["Smith", "Jones", "Taylor", "Brown", "Wilson", "Evans", "Patel"]) + str(i % 97),
+            "NationalInsuranceNumber": f"QQ{i:06d}C",
+            "DateOfBirth": iso(random_day(rng, date(1955, 1, 1), date(2006, 1, 1))),
+            "EmploymentStartDate": iso(start),
+            "ContinuousServiceDate": iso(start),
+            "EmploymentLeftDate": iso(left) if left else None,
+            "LeaverReason": rng.choice(["Resignation", "Retirement", "Redundancy", "Dismissal"]) if left else None,
+            "LastModifiedDate": iso(left or start),
+        })
+
+        job_start = start
+        job_count = rng.choice([1, 1, 1, 2, 2, 3])
+        for k in range(job_count):
+            latest = k == job_count - 1
+            job_end = left if latest else random_day(rng, job_start, left or today)
+            manager = f"emp-{rng.randrange(employees):07d}" if rng.random() > 0.002 else f"emp-x{i}"
+            job_records.append({
+                "Id": f"job-{len(job_records):08d}",
+                "EmployeeId": employee_id,
+                "JobTitle": rng.choice(["Engineer", "Analyst", "Manager", "Surveyor", "Technician", "Administrator"]),
+                "HierarchyNodeId": rng.choice(leaves),
+                "LineManagerId": manager,
+                "StartDate": iso(job_start),
+                "EndDate": iso(job_end) if job_end else None,
+                "LastModifiedDate": iso(job_end or job_start),
+            })
+            job_start = job_end or job_start
+
+    workforce = {"hierarchy": hierarchy, "employees": employee_records, "jobs": job_records}
+
+    for c in countries:
+        workers = []
+        for i in range(max(1, int(employees * adp_share[c]))):
+            code, long_name = rng.choices([("A", "Active"), ("L", "Leave"), ("T", "Terminated")], [0.93, 0.03, 0.04])[0]
+            workers.append({
+                "associateOID": f"{c.upper()}{i:08d}",
+                "workerID": {"idValue": f"{c[0].upper()}{i:06d}"},
+                "person": {"legalName": {"formattedName": f"Worker {c} {i}"}},
+                "workAssignments": [{
+                    "primaryIndicator": True,
+                    "positionID": f"POS{i:06d}",
+                    "hireDate": random_day(rng, date(1995, 1, 1), today).isoformat(),
+                    "assignmentStatus": {"statusCode": {"codeValue": code, "longName": long_name}},
+                    "homeOrganizationalUnits": [
+                        {"nameCode": {"codeValue": "HR"}},
+                        {"nameCode": {"codeValue": str(100 + i % 40), "shortName": f"Department {i % 40}"}},
+                    ],
+                }],
+            })
+        workforce[f"adp-{c}"] = workers
+
+    return workforce
+
+#----------------
+
+filter_token = re.compile(r"\s*('(?:[^']|'')*'|\(|\)|,|[^\s(),]+)")
+
+def field_values(record, path):
+    # Slash paths walk nested records; lists match if any element does
+    values = [record]
+    for part in path.split("/"):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(item.get(part) for item in value if isinstance(item, dict))
+            elif isinstance(value, dict) and part in value:
+                found.append(value[part])
+        values = [item for value in found for item in (value if isinstance(value, list) else [value])]
+    return values or [None]
+
+def compile_filter(text, root=None):
+    """
+    Compile the subset of OData $filter the pipeline sends into a predicate.
+
+    Supports eq, ne, gt, ge, lt, le, in and startswith(), negated with not
+    and joined with and/or and brackets. Literals are null, quoted strings
+    and bare values such as datetimes, which compare as strings.
+
+    Args:
+        text (str): The $filter expression.
+        root (str): Leading path segment to drop, e.g. "workers" for ADP.
+
+    Returns:
+        callable: record -> bool.
+    """
+    tokens = filter_token.findall(text)
+    position = 0
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def peek():
+        return tokens[position].lower() if position < len(tokens) else None
+
+    def literal(token):
+        if token.lower() == "null":
+            return None
+        if token.startswith("'"):
+            return token[1:-1].replace("''", "'")
+        return token
+
+    def comparison():
+        if peek() == "(":
+            take()
+            predicate = disjunction()
+            take()
+            return predicate
+
+        if peek() == "not":
+            take()
+            negated = comparison()
+            return lambda record: not negated(record)
+
+        if peek() == "startswith":
+            take(), take()
+            field = take()
+            take()
+            prefix = literal(take())
+            take()
+            return lambda record: any(isinstance(a, str) and a.startswith(prefix) for a in field_values(record, field))
+
+        field = take()
+        if root and field.startswith(root + "/"):
+            field = field[len(root) + 1:]
+        operator = take().lower()
+
+        if operator == "in":
+            take()
+            options = set()
+            while peek() != ")":
+                token = take()
+                if token != ",":
+                    options.add(literal(token))
+            take()
+            return lambda record: any(value in options for value in field_values(record, field))
+
+        value = literal(take())
+        compare = {
+            "eq": lambda a: a == value,
+            "ne": lambda a: a != value,
+            "gt": lambda a: a is not None and value is not None and a > value,
+            "ge": lambda a: a is not None and value is not None and a >= value,
+            "lt": lambda a: a is not None and value is not None and a < value,
+            "le": lambda a: a is not None and value is not None and a <= value,
+        }[operator]
+        return lambda record: any(compare(a) for a in field_values(record, field))
+
+    def conjunction():
+        predicates = [comparison()]
+        while peek() == "and":
+            take()
+            predicates.append(comparison())
+        return lambda record: all(predicate(record) for predicate in predicates)
+
+    def disjunction():
+        predicates = [conjunction()]
+        while peek() == "or":
+            take()
+            predicates.append(conjunction())
+        return lambda record: any(predicate(record) for predicate in predicates)
+
+    return disjunction()
+
+class TenantLimit:
+    # Token bucket per tenant; an empty bucket is a 429
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class StandInAPI:
+    """
+    State shared by the request handlers: the workforce, issued tokens,
+    rate limits, cached filter results and request counters.
+    """
+
+    def __init__(self, workforce, rate, token_ttl, latency):
+        self.workforce = workforce
+        self.employees_by_id = {record["Id"]: record for record in workforce["employees"]}
+        self.rate = rate
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.limits = {}
+        self.tokens = {}
+        self.matches = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def count(self, route, key, amount=1):
+        with self.lock:
+            counters = self.stats.setdefault(route, {"requests": 0, "records": 0, "throttled": 0, "unauthorised": 0})
+            counters[key] += amount
+
+    def issue_token(self, tenant):
+        with self.lock:
+            token = f"{tenant}-{len(self.tokens)}"
+            self.tokens[token] = (tenant, time.monotonic() + self.token_ttl)
+        return token
+
+    def tenant_for(self, authorization):
+        # None when the token is unknown or has expired
+        token = (authorization or "").removeprefix("Bearer ")
+        tenant, expires = self.tokens.get(token, (None, 0))
+        return tenant if time.monotonic() < expires else None
+
+    def allow(self, tenant):
+        with self.lock:
+            limit = self.limits.setdefault(tenant, TenantLimit(self.rate))
+        return limit.allow()
+
+    def matching(self, entity, api_filter, root=None):
+        # Filters are evaluated once per run; later pages slice the cached result
+        key = (entity, api_filter)
+        with self.lock:
+            if key not in self.matches:
+                records = self.workforce[entity]
+                if api_filter:
+                    predicate = compile_filter(api_filter, root)
+                    records = [record for record in records if predicate(record)]
+                self.matches[key] = records
+            return self.matches[key]
+
+def stand_in_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=None, headers=None):
+            content = json.dumps(body, separators=(",", ":")).encode("utf-8") if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self):
+            form = dict(parse_qsl(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")))
+            path = urlparse(self.path).path
+            if path == "/auth/oauth/v2/token":
+                tenant = "adp-" + form.get("client_id", "").removeprefix("bench-")
+            elif path == "/oauth2/v1/token":
+                tenant = "cascade"
+            else:
+                return self.reply(404, {"error": "not found"})
+
+            api.count(f"{tenant} token", "requests")
+            self.reply(200, {"access_token": api.issue_token(tenant), "token_type": "Bearer", "expires_in": api.token_ttl})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            if url.path == "/_stats":
+                return self.reply(200, api.stats)
+
+            tenant = api.tenant_for(self.headers.get("Authorization"))
+            route = self.route(url.path, query, tenant)
+            if tenant is None:
+                api.count(route, "unauthorised")
+                return self.reply(401, {"error": "invalid_token"})
+            if not api.allow(tenant):
+                api.count(route, "throttled")
+                return self.reply(429, {"error": "rate limited"}, {"Retry-After": "1"})
+
+            if api.latency:
+                time.sleep(api.latency)
+            api.count(route, "requests")
+
+            if tenant.startswith("adp-"):
+                return self.adp_workers(route, tenant, query)
+            return self.cascade(route, url.path, query)
+
+        def route(self, path, query, tenant):
+            if path == "/hr/v2/workers":
+                return f"{tenant or 'adp'} workers"
+            entity = path.split("/")[3] if path.count("/") >= 3 else path
+            if entity == "employees":
+                api_filter = query.get("$filter", "")
+                if path.count("/") > 3 or api_filter.startswith("Id in ("):
+                    return "cascade line managers"
+            return f"cascade {entity}"
+
+        def adp_workers(self, route, tenant, query):
+            top, skip = int(query.get("$top", 100)), int(query.get("$skip", 0))
+            workers = api.matching(tenant, query.get("$filter"), root="workers")
+            page = workers[skip:skip + top]
+            api.count(route, "records", len(page))
+
+            if not page and "count" not in query:
+                return self.reply(204)
+            body = {"workers": page}
+            if query.get("count") == "true":
+                body["meta"] = {"totalNumber": len(workers)}
+            self.reply(200, body)
+
+        def cascade(self, route, path, query):
+            parts = path.strip("/").split("/")
+            if parts[:2] != ["hr", "v2"] or len(parts) < 3 or parts[2] not in ("employees", "jobs", "hierarchy"):
+                return self.reply(404, {"error": "not found"})
+
+            if len(parts) == 4:
+                record = api.employees_by_id.get(parts[3])
+                if record is None:
+                    return self.reply(404, {"error": "not found"})
+                api.count(route, "records")
+                return self.reply(200, record)
+
+            top, skip = int(query.get("$top", 200)), int(query.get("$skip", 0))
+            records = api.matching(parts[2], query.get("$filter"))
+            page = records[skip:skip + top]
+            api.count(route, "records", len(page))
+
+            body = {"value": page}
+            if query.get("$count") == "true":
+                body["@odata.count"] = len(records)
+            self.reply(200, body)
+
+    return Handler
+
+def serve(employees, seed, rate, token_ttl, latency, ready):
+    # Runs in its own process; sends the bound port back once the data is ready
+    workforce = generate_workforce(employees, seed)
+    api = StandInAPI(workforce, rate, token_ttl, latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stand_in_handler(api))
+    server.daemon_threads = True
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+#----------------
+
+def rss_bytes():
+    # Current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class MemorySampler:
+    """
+    Samples RSS on a background thread and records the peak seen while each
+    stage was running. Stages overlap, so a peak belongs to every stage that
+    was running at the time.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.running = set()
+        self.peaks = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.record()
+
+    def record(self):
+        rss = rss_bytes()
+        with self.lock:
+            for name in self.running:
+                self.peaks[name] = max(self.peaks.get(name, 0), rss)
+
+    def wrap(self, name, fn):
+        def run():
+            with self.lock:
+                self.running.add(name)
+            try:
+                fn()
+            finally:
+                self.record()
+                with self.lock:
+                    self.running.discard(name)
+        return run
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+def configure_environment(port, args, output_dir):
+    # main.py reads these at import, so they are set before it is loaded
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "ADP_API_BASE": base,
+        "ADP_ACCOUNTS_BASE": base,
+        "CASCADE_API_BASE": base,
+        "SECRETS_BACKEND": "local",
+        "SECRETS_DIR": str(output_dir / "secrets"),
+        "HTTP_CACHE": "passthrough",
+        "CASCADE_SYNC": "full",
+        "EXPORT_FORMATS": args.formats,
+        "SECRET_CASCADE_API_ID": "bench-cascade",
+        "SECRET_CASCADEID_TO_DROP": json.dumps(["100000", "100001", "1000099*"]),
+        "SECRET_STRINGS_TO_EXCLUDE": "U000000,C000000",
+        "SECRET_COUNTRY_HIERARCHY_USA": "Acorn USA",
+        "SECRET_COUNTRY_HIERARCHY_CAN": "Acorn Canada",
+    })
+    for c in countries:
+        os.environ.update({
+            f"SECRET_ADP_{c.upper()}_CLIENT_ID": f"bench-{c}",
+            f"SECRET_ADP_{c.upper()}_CLIENT_SECRET": "bench",
+            f"SECRET_{c.upper()}_CERT_KEY": "bench key",
+            f"SECRET_{c.upper()}_CERT_PEM": "bench certificate",
+        })
+
+def stage_results(stages, timings, peaks, stats):
+    results = {}
+    for name in stages:
+        routes = [route for route, stage in route_stages.items() if stage == name]
+        requests_made = sum(stats.get(route, {}).get("requests", 0) for route in routes)
+        records = sum(stats.get(route, {}).get("records", 0) for route in routes)
+        seconds = timings[name]
+        results[name] = {
+            "seconds": round(seconds, 3),
+            "requests": requests_made,
+            "throttled": sum(stats.get(route, {}).get("throttled", 0) for route in routes),
+            "records": records,
+            "records_per_second": round(records / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(peaks.get(name, 0) / 2**20, 1),
+        }
+    return results
+
+def run_benchmark(args):
+    """
+    Start the stand-in servers, run every pipeline stage against them and
+    collect the figures.
+
+    Args:
+        args (argparse.Namespace): Parsed command line.
+
+    Returns:
+        dict: Run settings, wall time, process peak RSS, per-stage results
+        and the server's per-route counters.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=serve,
+        args=(args.employees, args.seed, args.server_rate, args.token_ttl, args.latency / 1000, sender),
+        daemon=True,
+    )
+    server.start()
+    print(f"Generating {args.employees} employees...")
+    port = receiver.recv()
+
+    output_dir = Path(tempfile.mkdtemp(prefix="headcount-benchmark-"))
+    (output_dir / "Data").mkdir()
+    configure_environment(port, args, output_dir)
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    os.chdir(output_dir)
+    import main
+
+    # The client starts at the server's rate rather than the production default
+    main.cascade_requests_per_second = main.adp_requests_per_second = args.client_rate
+    main.cascade_max_requests_per_second = main.adp_max_requests_per_second = args.server_rate
+    main.cascade_limiter = main.RateLimiter(args.client_rate, args.server_rate)
+
+    try:
+        stages = main.pipeline_stages(countries)
+        with MemorySampler() as sampler:
+            timed_stages = {name: (sampler.wrap(name, fn), deps) for name, (fn, deps) in stages.items()}
+            started = time.perf_counter()
+            timings = main.run_stages(timed_stages)
+            wall_time = time.perf_counter() - started
+
+        main.report_stages(stages, timings, wall_time)
+        stats = json.loads(main.requests.get(f"http://127.0.0.1:{port}/_stats").content)
+    finally:
+        server.terminate()
+
+    return {
+        "employees": args.employees,
+        "seed": args.seed,
+        "server_rate": args.server_rate,
+        "wall_seconds": round(wall_time, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1),
+        "stages": stage_results(stages, timings, sampler.peaks, stats),
+        "routes": stats,
+        "client_metrics": main.run_metrics.summary(),
+        "output_dir": str(output_dir),
+    }
+
+def print_results(results):
+    print("")
+    print(f"Benchmark - {results['employees']} employees, {results['wall_seconds']:.1f}s wall time, peak RSS {results['peak_rss_mb']} MB")
+    print(f"    {'Stage':<20} {'Seconds':>8} {'Requests':>9} {'429s':>6} {'Records':>9} {'Records/s':>10} {'Peak MB':>8}")
+    for name, stage in results["stages"].items():
+        rate = f"{stage['records_per_second']:.0f}" if stage["records_per_second"] is not None else "-"
+        print(f"    {name:<20} {stage['seconds']:8.2f} {stage['requests']:9d} {stage['throttled']:6d} {stage['records']:9d} {rate:>10} {stage['peak_rss_mb']:8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the headcount pipeline against local stand-in ADP and Cascade servers.")
+    parser.add_argument("--employees", type=int, default=10000, help="Cascade employees to generate (ADP tenants get a share)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-rate", type=float, default=50, help="Requests per second each tenant may make before a 429")
+    parser.add_argument("--client-rate", type=float, default=25, help="Starting request rate for the pipeline's limiters")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="Seconds before a bearer token expires")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to every API response")
+    parser.add_argument("--formats", default="xlsx", help="EXPORT_FORMATS for the run")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    results = run_benchmark(args)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as outfile:
+            json.dump(results, outfile, indent=4)
@@ -4,18 +4,50 @@ os.environ["GRPC_VERBOSITY"] = "NONE"
 os.environ["GRPC_TRACE"] = ""
 
 import sys
+import csv
 import json
+import base64
+import gzip
+import hashlib
+import re
 import math
+import random
+import shutil
+import itertools
+import sqlite3
 import tempfile
 from pathlib import Path
+from urllib.parse import urljoin, urlparse
 
 # Standard Library - Time/Date
 import time
-from datetime import date, datetime, timedelta
+import threading
+from collections import deque
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from typing import Any
+from email.utils import parsedate_to_datetime
 
 # Third-party - Data Processing
+import numpy as np
 import pandas as pd
 import requests
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+# Third-party - Optional (faster debug exports, typed ADP decoding)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 # Google Cloud Platform
 from google.auth import default
@@ -23,14 +55,98 @@ from google.auth.exceptions import DefaultCredentialsError
 from google.oauth2 import service_account
 from google.cloud import secretmanager
 
-adp_workers_url = 'https://api.adp.com/hr/v2/workers'
-cascade_workers_url = 'https://api.iris.co.uk/hr/v2/employees?%24count=true'
-cascade_jobs_url = 'https://api.iris.co.uk/hr/v2/jobs?%24count=true'
-cascade_hierarchy_url = 'https://api.iris.co.uk/hr/v2/hierarchy?%24count=true'
+# API hosts - overridable so a run can point at local stand-in servers (see benchmark.py)
+adp_api_base = os.getenv("ADP_API_BASE", "https://api.adp.com")
+adp_accounts_base = os.getenv("ADP_ACCOUNTS_BASE", "https://accounts.adp.com")
+cascade_api_base = os.getenv("CASCADE_API_BASE", "https://api.iris.co.uk")
+
+adp_workers_url = f'{adp_api_base}/hr/v2/workers'
+cascade_workers_url = f'{cascade_api_base}/hr/v2/employees?%24count=true'
+cascade_jobs_url = f'{cascade_api_base}/hr/v2/jobs?%24count=true'
+cascade_hierarchy_url = f'{cascade_api_base}/hr/v2/hierarchy?%24count=true'
 
 current_folder = Path(__file__).resolve().parent
 data_export = False
 
+# Debug export format - "json" (indented, written at the end, the default), or JSON Lines streamed
+# as records arrive: "jsonl", "jsonl.gz" or "jsonl.zst". orjson speeds up encoding and zstandard
+# enables .zst when they are installed
+data_export_format = os.getenv("DATA_EXPORT_FORMAT", "json")
+
+# Secrets - "gcp" reads Secret Manager; "local" reads SECRET_<ID> env vars, then files in SECRETS_DIR
+secrets_backend = os.getenv("SECRETS_BACKEND", "gcp")
+secrets_dir = os.getenv("SECRETS_DIR", str(current_folder / "secrets"))
+secret_ttl = 3600
+
+# Cascade sync - "full" downloads every run; "delta" keeps a local snapshot and only
+# downloads records changed since the last sync; "resync" rebuilds the snapshot
+cascade_sync = os.getenv("CASCADE_SYNC", "full")
+snapshot_path = current_folder / "Data" / "cascade_snapshot.sqlite"
+cascade_modified_field = "LastModifiedDate"
+
+# HTTP cache - "record" saves every response, "replay" serves them back without the network,
+# "resume" checkpoints every successful page so a failed run picks up where it stopped,
+# "passthrough" leaves it out. Responses hold PII, so they are encrypted with HTTP_CACHE_KEY,
+# and with a key set, checkpoints are on unless HTTP_CACHE says otherwise
+http_cache_mode = os.getenv("HTTP_CACHE", "resume" if os.getenv("HTTP_CACHE_KEY") else "passthrough")
+http_cache_dir = current_folder / "Data" / "http_cache"
+checkpoint_root = current_folder / "Data" / "checkpoints"
+checkpoint_dir = checkpoint_root / date.today().isoformat()
+
+# Cascade paging - concurrent page requests and the request rate they share
+cascade_page_workers = 4
+cascade_requests_per_second = 1.5
+cascade_max_requests_per_second = 10
+
+# ADP paging - per country (tenant), each with its own mTLS session and rate
+adp_page_workers = 4
+adp_requests_per_second = 1.5
+adp_max_requests_per_second = 10
+
+# Exclusions - with "on", service accounts dropped from Cascade are also left out of the $filter, so
+# they are never downloaded, up to this many Ids per query (longer lists are only filtered locally).
+# Pushdown uses OData 4.01 "in" and startswith(), so it is off unless the API is known to accept them
+exclusion_pushdown = os.getenv("EXCLUSION_PUSHDOWN", "off") == "on"
+exclusion_pushdown_limit = 100
+
+# ADP transform - with 1 or more (or "auto", one per CPU), pages are decoded, filtered and
+# rearranged on a process pool rather than in the main process; 0 keeps it in process
+adp_transform_processes = os.getenv("ADP_TRANSFORM_PROCESSES", "0")
+if adp_transform_processes == "auto":
+    adp_transform_processes = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+adp_transform_processes = int(adp_transform_processes)
+
+# Retries - times a request is retried after a 429, a 5xx or a connection error. Errors back off
+# exponentially with full jitter; 429s wait as long as the rate limiter says
+request_retries = 5
+retry_statuses = {500, 502, 503, 504}
+retry_backoff_base = 1.0
+retry_backoff_cap = 60
+request_timeout = 300
+
+# Bearer tokens - refreshed this many seconds before they expire (at most half their lifetime)
+token_refresh_margin = 60
+
+# Line managers missing from the headcount are looked up this many at a time
+line_manager_batch_size = 50
+
+# Cascade records are transformed this many at a time, one DataFrame per chunk
+cascade_chunk_size = 10000
+
+# Ordered payroll classification rules, matched against hierarchy levels L2-L6
+payroll_rules_path = os.getenv("PAYROLL_RULES", str(current_folder / "payroll_rules.json"))
+
+# Report formats to write, any of xlsx, csv and parquet
+export_formats = os.getenv("EXPORT_FORMATS", "xlsx").split(",")
+
+# Backfill - with 1 or more, ADP is skipped and the Cascade headcount and leaver reports are written
+# for each of that many month-ends up to the end of last month, from one download of employees and jobs
+backfill_months = int(os.getenv("BACKFILL_MONTHS", "0"))
+
+# Run metrics - "json" or "openmetrics", written to Data/ at the end of the run; "none" skips them
+metrics_format = os.getenv("METRICS", "json")
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
 today = date.today()
 first_day_this_month = today.replace(day=1)
 first_day_this_year = today.replace(month=1, day=1)
@@ -39,9 +155,26 @@ first_day_this_year_str = first_day_this_year.strftime("%Y-%m-%d")
 last_day_last_month = first_day_this_month - timedelta(days=1)
 last_day_str = last_day_last_month.strftime("%Y-%m-%d")
 
-print (f"Headcounts as of {last_day_str}")
-print (f"Leavers between {first_day_this_year_str} and {last_day_str}")
-print ("")
+def month_ends(count):
+    # The last `count` month-ends up to the end of last month, oldest first
+    ends = []
+    month_start = first_day_this_month
+    for _ in range(count):
+        month_end = month_start - timedelta(days=1)
+        ends.append(month_end)
+        month_start = month_end.replace(day=1)
+    return ends[::-1]
+
+backfill_dates = month_ends(backfill_months)
+
+def print_banner():
+    # Printed from __main__ only, so process pool workers re-importing this module stay quiet
+    if backfill_dates:
+        print (f"Backfilling headcounts and leavers for {len(backfill_dates)} month-ends, {backfill_dates[0]} to {backfill_dates[-1]}")
+    else:
+        print (f"Headcounts as of {last_day_str}")
+        print (f"Leavers between {first_day_this_year_str} and {last_day_str}")
+    print ("")
 
 def google_auth():
     try:
@@ -73,18 +206,78 @@ def google_auth():
 
         raise Exception("❌ No valid authentication method found")
 
+secret_cache = {}
+secret_lock = threading.Lock()
+secret_key_locks = {}
+secret_client = None
+
+def secret_manager():
+    # One Secret Manager client for the whole run
+    global secret_client
+    with secret_lock:
+        if secret_client is None:
+            secret_client = secretmanager.SecretManagerServiceClient(credentials=creds)
+        return secret_client
+
+def local_secret(secret_id):
+    env_name = "SECRET_" + "".join(ch if ch.isalnum() else "_" for ch in secret_id).upper()
+    # Files written by an editor or echo end in a newline, which would break the auth headers
+    if env_name in os.environ:
+        return os.environ[env_name].rstrip("\r\n")
+
+    file_path = Path(secrets_dir) / secret_id
+    if file_path.exists():
+        return file_path.read_text(encoding="utf-8").rstrip("\r\n")
+
+    raise KeyError(f"❌ Secret {secret_id} not found in {env_name} or {file_path}")
+
 def get_secret(secret_id, version_id="latest"):
-    client = secretmanager.SecretManagerServiceClient(credentials=creds)
-    name = f"projects/{project_Id}/secrets/{secret_id}/versions/{version_id}"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+    # Secrets are cached in memory for secret_ttl seconds. Stages run concurrently, so each
+    # secret has its own lock: callers asking for one already being fetched wait for that fetch
+    key = (secret_id, version_id)
+    with secret_lock:
+        key_lock = secret_key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        cached = secret_cache.get(key)
+        if cached and time.monotonic() - cached[1] < secret_ttl:
+            return cached[0]
+
+        if secrets_backend == "local":
+            value = local_secret(secret_id)
+        else:
+            name = f"projects/{project_Id}/secrets/{secret_id}/versions/{version_id}"
+            response = secret_manager().access_secret_version(request={"name": name})
+            value = response.payload.data.decode("UTF-8")
+
+        secret_cache[key] = (value, time.monotonic())
+        return value
+
+def get_secrets(secret_ids):
+    """
+    Fetch several secrets at once.
+
+    Each distinct secret is fetched once, concurrently, and anything still in
+    the cache is not fetched again.
+
+    Args:
+        secret_ids (dict): Name to use in the result -> secret id.
+
+    Returns:
+        dict: Name -> secret value.
+    """
+    distinct_ids = list(dict.fromkeys(secret_ids.values()))
+    with ThreadPoolExecutor(max_workers=len(distinct_ids) or 1) as executor:
+        values = dict(zip(distinct_ids, executor.map(get_secret, distinct_ids)))
+
+    return {k: values[v] for k, v in secret_ids.items()}
 
 def load_keys(country):
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"    Gathering Security Information for {country} ({now_str})")
     print(f"        Loading Security Keys ({now_str})")
 
-    # Secrets to load
+    # Secrets to load - the shared ones come from the cache after the first country
     secret_ids = {
         "client_id": f"ADP-{country}-client-id",
         "client_secret": f"ADP-{country}-client-secret",
@@ -97,7 +290,7 @@ def load_keys(country):
         "service_acc": "cascadeId_to_drop"
     }
 
-    secrets = {k: get_secret(v) for k, v in secret_ids.items()}
+    secrets = get_secrets(secret_ids)
 
     return (
         secrets["client_id"],
@@ -141,8 +334,68 @@ def load_ssl(certfile_content, keyfile_content):
         os.unlink(temp_keyfile.name)
         raise e
 
-def adp_bearer(client_id,client_secret,certfile,keyfile):
-    adp_token_url = 'https://accounts.adp.com/auth/oauth/v2/token'                                                                                          
+class TokenManager:
+    """
+    Bearer token for one API account, shared by every thread calling it.
+
+    The token is kept until shortly before expires_in runs out and then
+    refreshed ahead of time. Only one thread refreshes; the others wait
+    for it and reuse the new token. A 401 expires the token that was
+    rejected, so the next caller fetches a fresh one. Token requests are
+    retried after a 5xx or a connection error, with the same backoff as
+    every GET.
+    """
+
+    def __init__(self, tenant, token_url, send):
+        self.tenant = tenant
+        self.token_url = token_url
+        self.send = send
+        self.current = None
+        self.lock = threading.Lock()
+
+    def token(self):
+        current = self.current
+        if current and time.monotonic() < current[1]:
+            return current[0]
+
+        with self.lock:
+            current = self.current
+            if current is None or time.monotonic() >= current[1]:
+                current = self.refresh()
+            return current[0]
+
+    def refresh(self):
+        for attempt in range(request_retries + 1):
+            try:
+                token_response = cached_request(self.tenant, self.token_url, None, self.send, checkpoint=False)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == request_retries:
+                    raise
+                backoff(attempt)
+                continue
+
+            if token_response.status_code not in retry_statuses or attempt == request_retries:
+                break
+            backoff(attempt)
+
+        if token_response.status_code != 200:
+            raise Exception(f"❌ Token request for {self.tenant} failed ({token_response.status_code}): {token_response.text[:200]}")
+
+        token_data = token_response.json()
+        expires_in = float(token_data.get('expires_in') or 3600)
+        refresh_at = time.monotonic() + expires_in - min(token_refresh_margin, expires_in / 2)
+
+        self.current = (token_data['access_token'], refresh_at)
+        return self.current
+
+    def expire(self, stale_token):
+        # Several threads can be rejected with the same token; only the first clears it
+        with self.lock:
+            if self.current and self.current[0] == stale_token:
+                self.current = None
+
+def adp_bearer(client_id,client_secret,c):
+    adp_token_url = f'{adp_accounts_base}/auth/oauth/v2/token'                                                                                          
 
     adp_token_data = {
         'grant_type': 'client_credentials',
@@ -152,15 +405,15 @@ def adp_bearer(client_id,client_secret,certfile,keyfile):
     adp_headers = {
         'Content-Type': 'application/x-www-form-urlencoded',
     }
-    adp_token_response = requests.post(adp_token_url, cert=(certfile, keyfile), verify=True, data=adp_token_data, headers=adp_headers)
-
-    if adp_token_response.status_code == 200:
-        access_token = adp_token_response.json()['access_token']
+    # Tokens come through the country's pooled mTLS session, so refreshes reuse its handshake
+    adp_token = TokenManager(f"adp-{c}", adp_token_url, lambda: adp_sessions[c].post(adp_token_url, verify=True, data=adp_token_data, headers=adp_headers, timeout=request_timeout))
 
-    return access_token
+    # Fetch the first token now, so bad credentials stop the run before any paging starts
+    adp_token.token()
+    return adp_token
 
 def cascade_bearer (cascade_API_id):
-    cascade_token_url='https://api.iris.co.uk/oauth2/v1/token'
+    cascade_token_url=f'{cascade_api_base}/oauth2/v1/token'
     
     cascade_token_data = {
         'grant_type':'client_credentials',
@@ -170,486 +423,1458 @@ def cascade_bearer (cascade_API_id):
         "Authorization": f'Basic:{cascade_API_id}'
             }
 
-    cascade_token_response = requests.post(cascade_token_url, data=cascade_token_data, headers=cascade_headers)
+    cascade_token = TokenManager("cascade", cascade_token_url, lambda: requests.post(cascade_token_url, data=cascade_token_data, headers=cascade_headers, timeout=request_timeout))
 
-    #checks the api response and extracts the bearer token
-    if cascade_token_response.status_code == 200:
-        cascade_token = cascade_token_response.json()['access_token']
-    
+    cascade_token.token()
     return cascade_token
 
-def export_data(filename, variable):
+def export_default(value):
+    # Compact records export as their fields; anything else json cannot encode, as its str()
+    if isinstance(value, AdpWorker):
+        return value.to_dict()
+    return str(value)
+
+def json_line(record):
+    # One record per line; orjson is several times faster where it is installed
+    if orjson is None:
+        return (json.dumps(record, ensure_ascii=False, default=export_default) + "\n").encode("utf-8")
+    return orjson.dumps(record, default=export_default, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+
+def open_compressed(file_path, mode):
+    # Binary file object for .gz, .zst or plain files, picked by the file name
+    if file_path.name.endswith(".gz"):
+        return gzip.open(file_path, mode, compresslevel=1)
+    if file_path.name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("❌ DATA_EXPORT_FORMAT jsonl.zst needs the zstandard package")
+        return zstandard.open(file_path, mode)
+    return open(file_path, mode)
+
+def export_path(filename):
+    # "001a - Cascade Raw.json" becomes "001a - Cascade Raw.jsonl.gz" in the streamed formats
     file_path = Path(current_folder) / "Data" / filename
-    with open(file_path, "w", encoding='utf-8') as outfile:
-        json.dump(variable, outfile, indent=4, ensure_ascii=False)
+    if data_export_format == "json":
+        return file_path
+    return file_path.with_name(f"{file_path.stem}.{data_export_format}")
+
+def export_data(filename, variable):
+    file_path = export_path(filename)
+    if data_export_format == "json":
+        with open(file_path, "w", encoding='utf-8') as outfile:
+            json.dump(variable, outfile, indent=4, ensure_ascii=False, default=export_default)
+        return
+
+    with open_compressed(file_path, "wb") as outfile:
+        for record in variable:
+            outfile.write(json_line(record))
+
+def export_stream(filename, records):
+    # Pass records straight through; with data_export on, JSON Lines are written as each record
+    # passes, while the indented "json" format keeps a copy and writes it out at the end
+    if not data_export:
+        yield from records
+        return
+
+    if data_export_format == "json":
+        exported = []
+        for record in records:
+            exported.append(record)
+            yield record
+        export_data(filename, exported)
+        return
+
+    with open_compressed(export_path(filename), "wb") as outfile:
+        for record in records:
+            outfile.write(json_line(record))
+            yield record
+
+def read_export(file_path):
+    """
+    Read a debug export back, one record at a time, for replaying a stage.
+
+    Args:
+        file_path (str or Path): An export in any DATA_EXPORT_FORMAT - .json,
+            .jsonl, .jsonl.gz or .jsonl.zst.
+
+    Yields:
+        dict: Each record, in the order it was written.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == ".json":
+        with open(file_path, encoding="utf-8") as infile:
+            yield from json.load(infile)
+        return
+
+    decode = orjson.loads if orjson is not None else json.loads
+    with open_compressed(file_path, "rb") as infile:
+        for line in infile:
+            if line.strip():
+                yield decode(line)
+
+def ordered_map(executor, fn, items, window):
+    # Like executor.map, but only `window` calls are in flight or waiting to be read at once
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 #----------------
 
-def api_count_cascade(api_response,page_size):
-    response_data = api_response.json()
+class RateLimiter:
+    """
+    Token bucket shared by every thread calling the same API.
+
+    The refill rate adapts to the server: it creeps up by a small step after
+    each successful response (up to max_rate) and halves on a 429, so the run
+    settles just under the real quota. Retry-After and rate-limit headers
+    pause the whole bucket until the server says requests may resume.
+    """
+
+    def __init__(self, rate, max_rate, burst=None):
+        self.rate = rate
+        self.min_rate = rate / 8
+        self.max_rate = max_rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def observe(self, api_response):
+        headers = api_response.headers
+        with self.lock:
+            if api_response.status_code == 429:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0
+                delay = parse_retry_after(headers.get("Retry-After"))
+                self.pause(delay if delay is not None else 1 / self.rate)
+                return
+
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+            remaining = header_number(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+            if remaining is not None and remaining < 1:
+                reset = header_number(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+                if reset is not None:
+                    # Large values are epoch timestamps, small ones are seconds to wait
+                    self.pause(reset - time.time() if reset > 1e9 else reset)
+                self.tokens = 0
+
+    def pause(self, seconds):
+        if seconds > 0:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return (retry_at - datetime.now(timezone.utc)).total_seconds()
+
+def header_number(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+class RunMetrics:
+    """
+    Timings and counters for one run, shared by every thread.
+
+    Stages record wall time, CPU time of the stage's own thread, records
+    downloaded and report rows written. Requests are grouped by tenant and
+    endpoint, with a latency histogram per endpoint, response bytes, status
+    codes, retries and time spent waiting on the rate limiter.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.endpoints = {}
+        self.current = threading.local()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.lock = threading.Lock()
+
+    def stage_counters(self, name):
+        return self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "records": 0, "rows_written": 0})
+
+    def run_stage(self, name, fn):
+        # Records and rows counted on this thread while fn runs belong to the stage
+        self.current.stage = name
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            fn()
+        finally:
+            wall, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+            self.current.stage = None
+            with self.lock:
+                counters = self.stage_counters(name)
+                counters["wall_seconds"] += wall
+                counters["cpu_seconds"] += cpu
+        return wall
+
+    def count(self, field, amount):
+        name = getattr(self.current, "stage", None) or "unstaged"
+        with self.lock:
+            self.stage_counters(name)[field] += amount
+
+    def endpoint(self, tenant, api_url):
+        # Single-record lookups share one series rather than one per Id
+        path = re.sub(r"(/employees)/[^/?]+$", r"\1/{id}", urlparse(api_url).path)
+        key = (tenant, path)
+        if key not in self.endpoints:
+            with self.lock:
+                self.endpoints.setdefault(key, {
+                    "calls": 0, "retries": 0, "rate_limit_wait_seconds": 0.0, "response_bytes": 0,
+                    "statuses": {}, "latency_buckets": [0] * (len(latency_buckets) + 1),
+                    "latency_sum": 0.0, "latency_count": 0,
+                })
+        return self.endpoints[key]
+
+    def observe_call(self, tenant, api_url, attempts, waited):
+        counters = self.endpoint(tenant, api_url)
+        with self.lock:
+            counters["calls"] += 1
+            counters["retries"] += max(attempts - 1, 0)
+            counters["rate_limit_wait_seconds"] += waited
+
+    def observe_response(self, tenant, api_url, seconds, api_response):
+        counters = self.endpoint(tenant, api_url)
+        bucket = next((i for i, bound in enumerate(latency_buckets) if seconds <= bound), len(latency_buckets))
+        status = str(api_response.status_code)
+        with self.lock:
+            counters["latency_buckets"][bucket] += 1
+            counters["latency_sum"] += seconds
+            counters["latency_count"] += 1
+            counters["response_bytes"] += len(api_response.content)
+            counters["statuses"][status] = counters["statuses"].get(status, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for name, counters in self.stages.items():
+                wall = counters["wall_seconds"]
+                stages[name] = {**counters, "records_per_second": round(counters["records"] / wall, 1) if wall else None}
+
+            endpoints = []
+            for (tenant, path), counters in sorted(self.endpoints.items()):
+                cumulative = list(itertools.accumulate(counters["latency_buckets"]))
+                endpoints.append({
+                    "tenant": tenant,
+                    "endpoint": path,
+                    **{key: value for key, value in counters.items() if key != "latency_buckets"},
+                    "latency_histogram": dict(zip([str(bound) for bound in latency_buckets] + ["+Inf"], cumulative)),
+                })
+
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "cpu_seconds": time.process_time() - self.cpu_started,
+            "stages": stages,
+            "endpoints": endpoints,
+        }
+
+    def openmetrics(self):
+        summary = self.summary()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {help_text}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+        family("headcount_run_seconds", "gauge", "Wall and CPU time of the whole run.", [
+            ("", {"clock": "wall"}, summary["wall_seconds"]),
+            ("", {"clock": "cpu"}, summary["cpu_seconds"]),
+        ])
+        family("headcount_stage_seconds", "gauge", "Wall time and stage-thread CPU time per stage.", [
+            ("", {"stage": name, "clock": clock}, stage[f"{clock}_seconds"])
+            for name, stage in summary["stages"].items() for clock in ("wall", "cpu")
+        ])
+        family("headcount_stage_records", "counter", "Records downloaded by each stage.", [
+            ("_total", {"stage": name}, stage["records"]) for name, stage in summary["stages"].items()
+        ])
+        family("headcount_stage_rows_written", "counter", "Report rows written by each stage.", [
+            ("_total", {"stage": name}, stage["rows_written"]) for name, stage in summary["stages"].items()
+        ])
+
+        endpoints = summary["endpoints"]
+        family("headcount_requests", "counter", "API responses by status code.", [
+            ("_total", {"tenant": e["tenant"], "endpoint": e["endpoint"], "status": status}, count)
+            for e in endpoints for status, count in e["statuses"].items()
+        ])
+        family("headcount_request_retries", "counter", "Repeat attempts after a 429, 401, 5xx or connection error.", [
+            ("_total", {"tenant": e["tenant"], "endpoint": e["endpoint"]}, e["retries"]) for e in endpoints
+        ])
+        family("headcount_response_bytes", "counter", "Response body bytes received.", [
+            ("_total", {"tenant": e["tenant"], "endpoint": e["endpoint"]}, e["response_bytes"]) for e in endpoints
+        ])
+        family("headcount_rate_limit_wait_seconds", "counter", "Time spent waiting on the client rate limiter.", [
+            ("_total", {"tenant": e["tenant"], "endpoint": e["endpoint"]}, e["rate_limit_wait_seconds"]) for e in endpoints
+        ])
+
+        samples = []
+        for e in endpoints:
+            labels = {"tenant": e["tenant"], "endpoint": e["endpoint"]}
+            for bound, count in e["latency_histogram"].items():
+                samples.append(("_bucket", {**labels, "le": bound}, count))
+            samples.append(("_sum", labels, e["latency_sum"]))
+            samples.append(("_count", labels, e["latency_count"]))
+        family("headcount_request_duration_seconds", "histogram", "Latency of each API response.", samples)
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+run_metrics = RunMetrics()
+
+def export_metrics():
+    # Written once at the end of the run, in the format chosen by METRICS
+    if metrics_format == "openmetrics":
+        (Path("Data") / "Run Metrics.txt").write_text(run_metrics.openmetrics(), encoding="utf-8")
+    elif metrics_format == "json":
+        with open(Path("Data") / "Run Metrics.json", "w", encoding="utf-8") as outfile:
+            json.dump(run_metrics.summary(), outfile, indent=4)
+
+def pooled_session(pool_size, cert=None):
+    # Keep-alive session; with a client certificate every pooled connection reuses the mTLS handshake
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+    if cert:
+        session.cert = cert
+    return session
+
+http_cache_cipher = None
+
+def http_cache():
+    # Fernet cipher for the cache files, created on first use
+    global http_cache_cipher
+    if http_cache_cipher is None:
+        from cryptography.fernet import Fernet
+
+        key = os.getenv("HTTP_CACHE_KEY")
+        if not key:
+            raise Exception("❌ HTTP_CACHE_KEY is not set - create one with Fernet.generate_key()")
+        http_cache_cipher = Fernet(key)
+        http_cache_folder().mkdir(parents=True, exist_ok=True)
+    return http_cache_cipher
+
+def http_cache_folder():
+    return checkpoint_dir if http_cache_mode == "resume" else http_cache_dir
+
+def http_cache_path(tenant, api_url, api_params):
+    # Content-addressed: the same tenant, URL and params always map to the same file
+    request_key = json.dumps([tenant, api_url, api_params], sort_keys=True, default=str)
+    return http_cache_folder() / f"{hashlib.sha256(request_key.encode('utf-8')).hexdigest()}.bin"
+
+def prune_checkpoints():
+    # Checkpoints only resume a run on the day they were written
+    if checkpoint_root.exists():
+        for folder in checkpoint_root.iterdir():
+            if folder != checkpoint_dir:
+                shutil.rmtree(folder, ignore_errors=True)
+
+def clear_checkpoints():
+    # A finished run starts the next one from scratch
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+def cached_request(tenant, api_url, api_params, send, checkpoint=True):
+    """
+    Send a request through the record/replay HTTP cache.
+
+    In resume mode a response already checkpointed by an earlier, failed
+    run is served from disk, and only successful responses are saved, so
+    a rerun requests just the pages that are still missing.
+
+    Args:
+        tenant (str): Which API account the request belongs to, e.g. "cascade" or "adp-usa".
+        api_url (str): The request URL.
+        api_params (dict): The query parameters, part of the cache key.
+        send (callable): Makes the real request and returns the response.
+        checkpoint (bool): False for requests that must always be live in
+            resume mode, such as bearer tokens.
+
+    Returns:
+        requests.Response: The live response, or the recorded one in replay mode.
+    """
+    if http_cache_mode == "passthrough" or (http_cache_mode == "resume" and not checkpoint):
+        return send()
+
+    cipher = http_cache()
+    file_path = http_cache_path(tenant, api_url, api_params)
+
+    if http_cache_mode == "replay" or (http_cache_mode == "resume" and file_path.exists()):
+        if not file_path.exists():
+            raise Exception(f"❌ No recorded response for {tenant} {api_url} {api_params}")
+        stored = json.loads(cipher.decrypt(file_path.read_bytes()))
+
+        api_response = requests.Response()
+        api_response.status_code = stored["status_code"]
+        api_response.headers = requests.structures.CaseInsensitiveDict(stored["headers"])
+        api_response._content = base64.b64decode(stored["content"])
+        api_response.url = api_url
+        return api_response
+
+    api_response = send()
+    if http_cache_mode == "resume" and api_response.status_code != 200:
+        return api_response
+
+    stored = {
+        "status_code": api_response.status_code,
+        "headers": dict(api_response.headers),
+        "content": base64.b64encode(api_response.content).decode("ascii"),
+    }
+    # Write then rename, so a concurrent reader never sees half a file
+    temp_path = file_path.with_suffix(f".{threading.get_ident()}.tmp")
+    temp_path.write_bytes(cipher.encrypt(json.dumps(stored).encode("utf-8")))
+    os.replace(temp_path, file_path)
+    return api_response
+
+def backoff(failures):
+    # Full jitter: anywhere up to the exponential delay, so retrying threads spread out
+    time.sleep(random.uniform(0, min(retry_backoff_cap, retry_backoff_base * 2 ** failures)))
+
+def limited_get(session, limiter, api_url, tenant, auth=None, **kwargs):
+    # Replayed responses skip both the network and the limiter
+    def send():
+        # Wait for the shared limiter, and go round again if the server throttles us or fails
+        refreshed = False
+        waited = 0.0
+        failures = 0
+        attempts = 0
+        try:
+            for attempt in range(request_retries + 1):
+                attempts = attempt + 1
+                if auth:
+                    bearer = auth.token()
+                    kwargs["headers"] = {**kwargs.get("headers", {}), 'Authorization': f'Bearer {bearer}'}
+
+                waiting = time.perf_counter()
+                limiter.acquire()
+                sent = time.perf_counter()
+                waited += sent - waiting
+
+                try:
+                    api_response = session.get(api_url, timeout=request_timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == request_retries:
+                        raise
+                    backoff(failures)
+                    failures += 1
+                    continue
+
+                run_metrics.observe_response(tenant, api_url, time.perf_counter() - sent, api_response)
+                limiter.observe(api_response)
+
+                # An expired token gets one refresh and one retry rather than a lost page
+                if api_response.status_code == 401 and auth and not refreshed:
+                    auth.expire(bearer)
+                    refreshed = True
+                    continue
+
+                if api_response.status_code in retry_statuses and attempt < request_retries:
+                    backoff(failures)
+                    failures += 1
+                    continue
+
+                if api_response.status_code != 429:
+                    break
+        finally:
+            # Calls that end in an error are counted too
+            run_metrics.observe_call(tenant, api_url, attempts, waited)
+
+        return api_response
+
+    return cached_request(tenant, api_url, kwargs.get("params"), send)
+
+cascade_limiter = RateLimiter(cascade_requests_per_second, cascade_max_requests_per_second)
+cascade_session = pooled_session(cascade_page_workers)
+
+adp_tokens = {}
+adp_sessions = {}
+adp_limiters = {}
+
+def adp_connect(c, certfile, keyfile):
+    # One pooled mTLS session and one rate limiter per country
+    adp_sessions[c] = pooled_session(adp_page_workers, cert=(certfile, keyfile))
+    adp_limiters[c] = RateLimiter(adp_requests_per_second, adp_max_requests_per_second)
+
+def api_count_cascade(response_data,page_size):
     total_number = response_data['@odata.count']
     api_calls = math.ceil(total_number / page_size)
 
     return api_calls
 
 def api_call_cascade(cascade_token,api_url,api_params=None,api_data=None):
-    cascade_api_headers = {
-    'Authorization': f'Bearer {cascade_token}',
-    }
+    api_response = limited_get(cascade_session, cascade_limiter, api_url, "cascade", auth = cascade_token, params = api_params, json=api_data)
 
-    api_response = requests.get(api_url, headers = cascade_api_headers, params = api_params, json=api_data)
-    time.sleep(0.6)   
-   
     return api_response
 
-def api_count_adp(page_size,url,headers,type):
+def iterate_pages_cascade(api_url,api_filter=None,page_size=200):
+    """
+    Yield the pages of a Cascade list endpoint, one list of records at a time.
+
+    Page 0 is requested with $count=true (part of the endpoint URL), so it
+    serves as both the record count and the first page. After that:
+
+    - if the server returns @odata.nextLink, the links are followed in turn
+      (server-driven paging, no deep $skip offsets);
+    - otherwise the remaining $skip pages are fetched on a thread pool and
+      yielded in page order. If the last page comes back full, records were
+      inserted while paging, so further pages are read until a short one.
+
+    Args:
+        api_url (str): The endpoint URL, including $count=true.
+        api_filter (str): Optional OData $filter expression.
+        page_size (int): Records requested per page.
 
-    api_count_params = {
-            "$filter": f"workers/workAssignments/assignmentStatus/statusCode/codeValue eq '{type}'",
-            "count": "true",
+    Yields:
+        list: The records of each page, in page order.
+    """
+    def fetch_page(i):
+        api_params = {
+            "$top": page_size,
+            "$skip": i * page_size,
         }
-    
-    api_count_response = requests.get(url, cert=(certfile, keyfile), verify=True, headers=headers, params=api_count_params) 
-    response_data = api_count_response.json()
-    total_number = response_data.get("meta", {}).get("totalNumber", 0)
+        if api_filter:
+            api_params["$filter"] = api_filter
+
+        api_response = api_call_cascade(cascade_token,api_url,api_params,None)
+
+        # A missing page would quietly shrink the headcount, so the run stops instead
+        if api_response.status_code != 200:
+            raise Exception(f"❌ Cascade page {i} of {api_url} failed ({api_response.status_code}): {api_response.text[:200]}")
+        return api_response.json()
+
+    first_page = fetch_page(0)
+    run_metrics.count("records", len(first_page['value']))
+    yield first_page['value']
+
+    next_link = first_page.get('@odata.nextLink')
+    if next_link:
+        while next_link:
+            api_response = api_call_cascade(cascade_token,urljoin(api_url, next_link))
+            if api_response.status_code != 200:
+                raise Exception(f"❌ Cascade page {next_link} failed ({api_response.status_code}): {api_response.text[:200]}")
+            json_data = api_response.json()
+            run_metrics.count("records", len(json_data['value']))
+            yield json_data['value']
+            next_link = json_data.get('@odata.nextLink')
+        return
+
+    api_calls = api_count_cascade(first_page,page_size) if '@odata.count' in first_page else 1
+    page = first_page['value']
+
+    # Pages come back in submission order, whatever order they finish in
+    with ThreadPoolExecutor(max_workers=cascade_page_workers) as executor:
+        for json_data in ordered_map(executor, fetch_page, range(1, api_calls), 2 * cascade_page_workers):
+            page = json_data['value']
+            run_metrics.count("records", len(page))
+            yield page
+
+    # Records inserted during the run push the tail past the original count
+    i = max(api_calls, 1)
+    while len(page) == page_size:
+        page = fetch_page(i)['value']
+        run_metrics.count("records", len(page))
+        yield page
+        i += 1
+
+def iterate_records_cascade(api_url,api_filter=None,page_size=200):
+    # A record seen twice, because inserts shifted the $skip offsets, is only yielded the first time
+    seen_ids = set()
+
+    for page in iterate_pages_cascade(api_url,api_filter,page_size):
+        for record in page:
+            record_id = record.get("Id")
+            if record_id is not None:
+                if record_id in seen_ids:
+                    continue
+                seen_ids.add(record_id)
+            yield record
+
+def api_count_adp(total_number,page_size):
     api_calls = math.ceil(total_number / page_size)
 
     return api_calls
 
-def api_call(page_size,skip_param,api_url,api_headers,type):
+def api_call(page_size,skip_param,api_url,api_headers,type,c,count=False):
     
     api_params = {
     "$filter": f"workers/workAssignments/assignmentStatus/statusCode/codeValue eq '{type}'",
     "$top": page_size,
     "$skip": skip_param
     }
+    if count:
+        api_params["count"] = "true"
 
-    api_response = requests.get(api_url,cert=(certfile, keyfile), headers = api_headers, params = api_params)
-    time.sleep(0.6)   
+    api_response = limited_get(adp_sessions[c], adp_limiters[c], api_url, f"adp-{c}", auth = adp_tokens[c], headers = api_headers, params = api_params)
 
     return api_response    
 
 #----------------
 
-def GET_workers_cascade():
-    time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print ("    Retrieving current Personal Data from Cascade HR (" + time_now + ")")
-
-    cascade_responses = []
-    skip_param = 0
-    page_size = 200
+snapshot_connections = threading.local()
+synced_entities = set()
+
+def snapshot_store():
+    # One connection per thread, so stages running side by side can sync different entities
+    connection = getattr(snapshot_connections, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(snapshot_path, timeout=300)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "entity TEXT, id TEXT, data TEXT, PRIMARY KEY (entity, id))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks (entity TEXT PRIMARY KEY, synced_at TEXT)"
+        )
+        connection.commit()
+        snapshot_connections.connection = connection
+    return connection
+
+def sync_snapshot(entity, api_url):
+    """
+    Bring one entity in the local snapshot up to date with Cascade.
 
-    api_params = {
-        "$filter": (
-            f"(EmploymentLeftDate eq null or EmploymentLeftDate gt {last_day_str}T00:00:00Z) "
-            f"and EmploymentStartDate le {last_day_str}T00:00:00Z"
-            )  
-        }
+    In delta mode only records whose cascade_modified_field is on or after
+    the last watermark are downloaded and merged in by Id. The first sync,
+    and every sync in resync mode, downloads the whole endpoint unfiltered
+    and replaces the entity. The new watermark is taken before downloading,
+    so changes made while the sync runs are picked up next time.
 
-    api_response = api_call_cascade(cascade_token,cascade_workers_url,api_params,None)
-    api_calls = api_count_cascade(api_response,page_size)        
-
-    for i in range(api_calls):
-            skip_param = i * page_size
-            
-            api_params = {
-                "$top": page_size,
-                "$skip": skip_param,
-                "$filter": (
-                    f"(EmploymentLeftDate eq null or EmploymentLeftDate ge {last_day_str}T00:00:00Z) "
-                    f"and EmploymentStartDate le {last_day_str}T00:00:00Z"
-                )
-            }
+    Pages are staged in a temporary table while downloading and merged in
+    one short transaction at the end, so a sync that fails part way leaves
+    the snapshot untouched and other entities can sync at the same time.
 
-            api_response = api_call_cascade(cascade_token,cascade_workers_url,api_params)
+    Deleted records are only removed by a resync.
 
-            if api_response.status_code == 200:
-                json_data = api_response.json()
-                json_data = json_data['value']
-                cascade_responses.extend(json_data)    
+    Args:
+        entity (str): Snapshot name, e.g. "employees".
+        api_url (str): The Cascade endpoint URL, including $count=true.
+    """
+    if entity in synced_entities:
+        return
+
+    connection = snapshot_store()
+    row = connection.execute("SELECT synced_at FROM watermarks WHERE entity = ?", (entity,)).fetchone()
+    watermark = row[0] if row and cascade_sync == "delta" else None
+    sync_started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    if watermark:
+        print(f"         Syncing {entity} changed since {watermark}...")
+        api_filter = f"{cascade_modified_field} ge {watermark}"
+    else:
+        print(f"         Full sync of {entity}...")
+        api_filter = None
+
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS staged (id TEXT PRIMARY KEY, data TEXT)")
+    connection.execute("DELETE FROM staged")
+    for page in iterate_pages_cascade(api_url, api_filter):
+        connection.executemany(
+            "INSERT OR REPLACE INTO staged (id, data) VALUES (?, ?)",
+            [(str(record["Id"]), json.dumps(record)) for record in page]
+        )
+
+    with connection:
+        if not watermark:
+            connection.execute("DELETE FROM records WHERE entity = ?", (entity,))
+        connection.execute(
+            "INSERT OR REPLACE INTO records (entity, id, data) SELECT ?, id, data FROM staged", (entity,)
+        )
+        connection.execute("INSERT OR REPLACE INTO watermarks (entity, synced_at) VALUES (?, ?)", (entity, sync_started))
+    connection.execute("DELETE FROM staged")
+    connection.commit()
+    synced_entities.add(entity)
+
+def snapshot_records(entity):
+    for (data,) in snapshot_store().execute("SELECT data FROM records WHERE entity = ?", (entity,)):
+        yield json.loads(data)
+
+def cascade_records(entity, api_url, api_filter=None, keep=None):
+    # keep() applies api_filter to snapshot records, which are stored unfiltered
+    if cascade_sync == "full":
+        return iterate_records_cascade(api_url, api_filter)
+
+    sync_snapshot(entity, api_url)
+    return (record for record in snapshot_records(entity) if keep is None or keep(record))
+
+class ExclusionList:
+    """
+    Ids to leave out of a report, parsed once from a secret.
+
+    The secret is a JSON or Python-style list, or a string of entries
+    separated by commas, semicolons or whitespace. An entry is an exact Id,
+    a prefix ending in "*" (e.g. "SVC*"), or a regular expression after
+    "re:" that must match the whole Id. Exact Ids are held in a set, so
+    `id in exclusions` is a hash lookup and never matches part of a longer
+    Id. Ids and prefixes may only hold letters, digits, "_", ".", "@" and
+    "-", so a secret with any other separator fails rather than silently
+    excluding nothing.
+    """
 
-    print("         Filtering out service accounts...")
-    filtered_responses = [
-        record for record in cascade_responses
-        if str(record.get("DisplayId")) not in service_acc
-    ]
+    def __init__(self, exact=(), prefixes=(), patterns=()):
+        self.exact = frozenset(exact)
+        self.prefixes = tuple(prefixes)
+        self.patterns = tuple(patterns)
+        self.pattern = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+    @classmethod
+    def parse(cls, secret):
+        secret = (secret or "").strip()
+        if secret.startswith("["):
+            try:
+                entries = [str(entry) for entry in json.loads(secret)]
+            except ValueError:
+                # e.g. ['A1','B2'] - the quotes are stripped from each entry below
+                entries = re.split(r"[,;\s]+", secret.strip("[]"))
+        else:
+            entries = re.split(r"[,;\s]+", secret)
+
+        exact, prefixes, patterns = [], [], []
+        for entry in entries:
+            entry = entry.strip().strip("'\"")
+            if not entry:
+                continue
+            if entry.startswith("re:"):
+                patterns.append(entry[3:])
+            elif entry.endswith("*"):
+                prefixes.append(entry[:-1])
+            else:
+                exact.append(entry)
+
+        for entry in exact + prefixes:
+            if not re.fullmatch(r"[\w.@-]+", entry):
+                raise Exception(f"❌ Exclusion entry {entry!r} is not an Id - separate Ids with commas, semicolons or whitespace, or write a pattern as re:...")
+        return cls(exact, prefixes, patterns)
+
+    def __str__(self):
+        return f"{len(self.exact)} Ids, {len(self.prefixes)} prefixes and {len(self.patterns)} patterns"
+
+    def __contains__(self, value):
+        if value is None:
+            return False
+        value = str(value)
+        return (
+            value in self.exact
+            or (bool(self.prefixes) and value.startswith(self.prefixes))
+            or (self.pattern is not None and self.pattern.fullmatch(value) is not None)
+        )
+
+    def odata_filter(self, field):
+        """
+        The exact Ids and prefixes as an OData condition that drops them.
+
+        Patterns cannot be expressed in $filter, so they are only applied
+        locally; the local check always runs, so pushing down is purely a
+        saving.
+
+        Args:
+            field (str): The field the Ids are in, e.g. "DisplayId".
+
+        Returns:
+            str: e.g. "not (DisplayId in ('1','2')) and not startswith(DisplayId,'SVC')",
+            or None when there is nothing to push down or more than
+            exclusion_pushdown_limit entries.
+        """
+        if len(self.exact) + len(self.prefixes) > exclusion_pushdown_limit:
+            return None
+
+        def quoted(value):
+            return "'" + value.replace("'", "''") + "'"
+
+        conditions = []
+        if self.exact:
+            conditions.append(f"not ({field} in ({','.join(quoted(value) for value in sorted(self.exact))}))")
+        conditions.extend(f"not startswith({field},{quoted(prefix)})" for prefix in self.prefixes)
+        return " and ".join(conditions) or None
+
+adp_exclusions = ExclusionList()
+cascade_exclusions = ExclusionList()
+
+def excluding(api_filter, exclusions, field):
+    # Adds the exclusions to a Cascade $filter where they can be pushed down
+    pushed = exclusions.odata_filter(field) if exclusion_pushdown else None
+    if not pushed:
+        return api_filter
+    return f"({api_filter}) and {pushed}" if api_filter else pushed
+
+def headcount_window():
+    # Employees in post at the end of last month: the $filter, and the same test for local records
+    as_of = f"{last_day_str}T00:00:00"
+    api_filter = (
+        f"(EmploymentLeftDate eq null or EmploymentLeftDate ge {as_of}Z) "
+        f"and EmploymentStartDate le {as_of}Z"
+    )
 
-    if data_export:
-        export_data("001a - Cascade Raw.json", cascade_responses)    
-        export_data("001b - Cascade Filtered.json", filtered_responses)    
+    def keep(record):
+        # Only the first 19 characters are compared, so "Z", "+00:00" and fractions all match the filter
+        left = record.get("EmploymentLeftDate")
+        start = record.get("EmploymentStartDate")
+        return (left is None or left[:19] >= as_of) and start is not None and start[:19] <= as_of
+
+    return api_filter, keep
+
+def leaver_window():
+    # Employees who left between the start of the year and the end of last month
+    window_start = f"{first_day_this_year_str}T00:00:00"
+    window_end = f"{last_day_str}T00:00:00"
+    api_filter = f"EmploymentLeftDate ge {window_start}Z and EmploymentLeftDate le {window_end}Z"
+
+    def keep(record):
+        left = record.get("EmploymentLeftDate")
+        return left is not None and window_start <= left[:19] <= window_end
+
+    return api_filter, keep
+
+def backfill_window(as_of_dates):
+    # Anyone in a backfill period's headcount or leavers: in post at some month-end between the first
+    # and the last, or left between the start of the first month-end's year and the last month-end
+    first = f"{as_of_dates[0]:%Y-%m-%d}T00:00:00"
+    last = f"{as_of_dates[-1]:%Y-%m-%d}T00:00:00"
+    year_start = f"{as_of_dates[0]:%Y}-01-01T00:00:00"
+    api_filter = (
+        f"((EmploymentLeftDate eq null or EmploymentLeftDate ge {first}Z) and EmploymentStartDate le {last}Z) "
+        f"or (EmploymentLeftDate ge {year_start}Z and EmploymentLeftDate le {last}Z)"
+    )
 
-    return filtered_responses
+    def keep(record):
+        left = record.get("EmploymentLeftDate")
+        start = record.get("EmploymentStartDate")
+        left = left[:19] if left is not None else None
+        in_post = (left is None or left >= first) and start is not None and start[:19] <= last
+        return in_post or (left is not None and year_start <= left <= last)
 
-def GET_leavers_cascade():
-    time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print ("    Retrieving current Leavers from Cascade HR (" + time_now + ")")
+    return api_filter, keep
 
-    cascade_responses = []
-    skip_param = 0
-    page_size = 200
+def GET_employees_cascade(leavers):
+    """
+    Fetch the headcount and this year's leavers in a single sweep of /employees.
 
-    api_params = {
-        "$filter": (
-            f"EmploymentLeftDate ge {first_day_this_year_str}T00:00:00Z and EmploymentLeftDate le {last_day_str}T00:00:00Z"
-            )  
-        }
+    The $filter is the union of the headcount and leaver windows, so each
+    employee is downloaded once, and records are split locally with the
+    same tests the two windows use. Headcount records are yielded as they
+    arrive; leavers are collected into `leavers` for the leavers report.
 
-    api_response = api_call_cascade(cascade_token,cascade_workers_url,api_params,None)
-    api_calls = api_count_cascade(api_response,page_size)        
-
-    for i in range(api_calls):
-            skip_param = i * page_size
-            
-            api_params = {
-                "$top": page_size,
-                "$skip": skip_param,
-                "$filter": (
-                    f"EmploymentLeftDate ge {first_day_this_year_str}T00:00:00Z and EmploymentLeftDate le {last_day_str}T00:00:00Z"
-                )
-            }
+    Args:
+        leavers (list): Receives this year's leavers, service accounts removed.
 
-            api_response = api_call_cascade(cascade_token,cascade_workers_url,api_params)
+    Yields:
+        dict: Each employee in the headcount, service accounts removed.
+    """
+    time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print ("    Retrieving current Personal Data and Leavers from Cascade HR (" + time_now + ")")
 
-            if api_response.status_code == 200:
-                json_data = api_response.json()
-                json_data = json_data['value']
-                cascade_responses.extend(json_data)    
+    headcount_filter, in_headcount = headcount_window()
+    leaver_filter, is_leaver = leaver_window()
+    api_filter = f"({headcount_filter}) or ({leaver_filter})"
 
-    print("         Filtering out service accounts...")
-    filtered_responses = [
-        record for record in cascade_responses
-        if str(record.get("DisplayId")) not in service_acc
-    ]
+    def keep(record):
+        return in_headcount(record) or is_leaver(record)
 
-    if data_export:
-        export_data("002a - Cascade Leavers Raw.json", cascade_responses)    
-        export_data("002b - Cascade Leavers Filtered.json", filtered_responses)    
+    cascade_responses = cascade_records("employees", cascade_workers_url, excluding(api_filter, cascade_exclusions, "DisplayId"), keep)
+    cascade_responses = export_stream("001a - Cascade Employees Raw.json", cascade_responses)
 
-    return filtered_responses
+    for record in cascade_responses:
+        if record.get("DisplayId") in cascade_exclusions:
+            continue
+        if is_leaver(record):
+            leavers.append(record)
+        if in_headcount(record):
+            yield record
 
-def GET_jobs_cascade():
+def GET_jobs_cascade(as_of=None):
     time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print ("    Retrieving current Jobs Data from Cascade HR (" + time_now + ")")
 
-    # Calculate six months ago
-    previous_jobs = today - timedelta(days=400)
+    # Calculate six months ago (before the earliest backfill month-end, if given)
+    previous_jobs = (as_of or today) - timedelta(days=400)
     previous_jobs_str = previous_jobs.strftime("%Y-%m-%d")
 
-    cascade_responses = []
-    skip_param = 0
-    page_size = 200
+    api_filter = f"EndDate eq null or EndDate ge {previous_jobs_str}T00:00:00Z"
+    window_start = f"{previous_jobs_str}T00:00:00"
 
-    api_params = {
-        "$filter": (
-            f"EndDate eq null or EndDate ge {previous_jobs_str}T00:00:00Z"
-            )  
-        }
+    def keep(record):
+        # Only the first 19 characters are compared, so "Z", "+00:00" and fractions all match the filter
+        end = record.get("EndDate")
+        return end is None or end[:19] >= window_start
 
-    api_response = api_call_cascade(cascade_token,cascade_jobs_url,api_params,None)
-    api_calls = api_count_cascade(api_response,page_size)        
-
-    for i in range(api_calls):
-            skip_param = i * page_size
-            
-            api_params = {
-                "$top": page_size,
-                "$skip": skip_param,
-                "$filter": (
-                    f"EndDate eq null or EndDate ge {previous_jobs_str}T00:00:00Z"
-                )
-            }
+    cascade_responses = cascade_records("jobs", cascade_jobs_url, api_filter, keep)
 
-            api_response = api_call_cascade(cascade_token,cascade_jobs_url,api_params,None)
+    return list(export_stream("001d - Cascade Jobs Raw.json", cascade_responses))
 
-            if api_response.status_code == 200:
-                json_data = api_response.json()
-                json_data = json_data['value']
-                cascade_responses.extend(json_data)
+# Every employee field the headcount and leaver reports read
+backfill_fields = (
+    "Id", "DisplayId", "KnownAs", "LastName", "NationalInsuranceNumber", "ContinuousServiceDate",
+    "LeaverReason", "DateOfBirth", "EmploymentStartDate", "EmploymentLeftDate",
+)
 
-    if data_export:
-        export_data("001d - Cascade Jobs Raw.json", cascade_responses)
+def GET_employees_backfill(as_of_dates):
+    """
+    Fetch everyone in any backfill period's headcount or leavers in a single sweep of /employees.
+
+    Args:
+        as_of_dates (list): The month-ends to report on, oldest first.
 
-    return cascade_responses    
+    Returns:
+        list: Employee records trimmed to backfill_fields, service accounts removed.
+    """
+    time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print ("    Retrieving Personal Data and Leavers for every backfill period from Cascade HR (" + time_now + ")")
+
+    api_filter, keep = backfill_window(as_of_dates)
+
+    cascade_responses = cascade_records("employees", cascade_workers_url, excluding(api_filter, cascade_exclusions, "DisplayId"), keep)
+    cascade_responses = export_stream("001a - Cascade Employees Raw.json", cascade_responses)
+
+    return [
+        {key: record.get(key) for key in backfill_fields}
+        for record in cascade_responses
+        if record.get("DisplayId") not in cascade_exclusions
+    ]
 
 def GET_hierarchy_cascade():
     time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print ("    Retrieving current Hierarchy Data from Cascade HR (" + time_now + ")")
 
-    cascade_responses = []
-    skip_param = 0
-    page_size = 200
+    cascade_responses = cascade_records("hierarchy", cascade_hierarchy_url)
+
+    return list(export_stream("001c - Cascade Hierarchy Nodes.json", cascade_responses))
+
+payroll_rules = None
 
+def load_payroll_rules():
+    """
+    Load the payroll rule table and compile it, once per run.
 
-    api_response = api_call_cascade(cascade_token,cascade_hierarchy_url,None,None)
-    api_calls = api_count_cascade(api_response,page_size)        
+    Each rule has a name, a payroll and either "all" or "any" matchers. A
+    matcher is true when any of its fields contains any of its strings, so
+    each matcher compiles to a single alternation regex. Rules are tried in
+    file order and the first one to match wins.
 
-    for i in range(api_calls):
-            skip_param = i * page_size
-            
-            api_params = {
-                "$top": page_size,
-                "$skip": skip_param,
-           }
+    Returns:
+        dict: {"default": payroll name, "rules": [(name, payroll, mode, matchers)]},
+        where matchers are (fields, compiled regex) pairs.
+    """
+    global payroll_rules
+    if payroll_rules is None:
+        with open(payroll_rules_path, encoding="utf-8") as f:
+            config = json.load(f)
+
+        rules = []
+        for rule in config["rules"]:
+            mode = "any" if "any" in rule else "all"
+            matchers = [
+                (
+                    matcher["fields"],
+                    re.compile(
+                        "|".join(re.escape(text) for text in matcher["contains"]),
+                        re.IGNORECASE if matcher.get("ignore_case") else 0,
+                    ),
+                )
+                for matcher in rule[mode]
+            ]
+            rules.append((rule["name"], rule["payroll"], mode, matchers))
 
-            api_response = api_call_cascade(cascade_token,cascade_hierarchy_url,api_params,None)
+        payroll_rules = {"default": config["default"], "rules": rules}
+    return payroll_rules
 
-            if api_response.status_code == 200:
-                json_data = api_response.json()
-                json_data = json_data['value']
-                cascade_responses.extend(json_data)    
+def classify_payroll(levels):
+    """
+    Classify every row of a hierarchy levels frame in bulk.
 
+    Args:
+        levels (DataFrame): Columns L2, L3, L4 and L6 (missing values allowed).
 
-    if data_export:
-        export_data("001c - Cascade Hierarchy Nodes.json", cascade_responses)    
+    Returns:
+        tuple: (payroll names, names of the rules that fired) as Series. Rows
+        no rule matches get the default payroll and the rule name "Default".
+    """
+    config = load_payroll_rules()
+    text = {field: levels[field].fillna("").astype(str) for field in ("L2", "L3", "L4", "L6")}
+
+    conditions = []
+    for name, payroll, mode, matchers in config["rules"]:
+        matches = [
+            np.logical_or.reduce([text[field].str.contains(pattern).to_numpy() for field in fields])
+            for fields, pattern in matchers
+        ]
+        combine = np.logical_or if mode == "any" else np.logical_and
+        conditions.append(combine.reduce(matches))
+
+    # np.select takes the first true condition, which keeps the rule order
+    payrolls = [payroll for name, payroll, mode, matchers in config["rules"]]
+    names = [name for name, payroll, mode, matchers in config["rules"]]
+    payroll_names = np.select(conditions, payrolls, default=config["default"]) if conditions else config["default"]
+    rule_names = np.select(conditions, names, default="Default") if conditions else "Default"
 
-    return cascade_responses
+    return (
+        pd.Series(payroll_names, index=levels.index, dtype=object),
+        pd.Series(rule_names, index=levels.index, dtype=object),
+    )
 
-def determine_payroll(L2, L3, L4, L6):
-    # Convert to string and handle None values
-    L2 = str(L2) if L2 is not None else ""
-    L3 = str(L3) if L3 is not None else ""
-    L4 = str(L4) if L4 is not None else "" 
-    L6 = str(L6) if L6 is not None else ""
-    
-    # Check if L4 contains 'Lemac'
-    if 'Lemac' in L4:
-        payroll = "Lemac"
-        return payroll
-    
-    if any(country in L2.lower() for country in ['germany', 'france', 'italy', 'uk']):
-        if 'surveyor' in L6.lower() or 'surveyor' in L4.lower() or 'surveyor' in L3.lower():
-            payroll = "Not on Payroll"
-            return payroll
-    
-    # Check if L2 contains 'Group' or '(UK)'
-    if 'Group' in L2 or '(UK)' in L2 or '(935)' in L3:
-        payroll = "Acorn UK"
-        return payroll
-    
-   
-    country_mapping = {
-        'Germany': 'Acorn Germany (Bureau)',
-        'Italy': 'Acorn Italy (Bureau)',
-        'France': 'Acorn France (Bureau)',
-        'South Africa': 'Acorn South Africa (Mazars)',
-        'USA': 'Acorn Inc (ADP)',
-        'Australia': 'Acorn Australia (Bureau)',
-        'New Zealand': 'Acorn New Zealand',
-        'Isle of Man': 'Acorn Isle of Man',
-        'Canada': 'Acorn Canada (ADP)',
-        'Singapore': 'Acorn Singapore (Bureau)'
+def build_hierarchy_table(hierarchy_nodes):
+    """
+    Resolve the L1-L6 path and payroll name of every hierarchy node in one pass.
+
+    Each node's levels are built from its parent's already-resolved levels, so
+    every node is visited once however many employees sit under it. A missing
+    parent (orphan) or a parent that leads back into the current chain (cycle)
+    ends the walk, and the node is treated as a root.
+
+    Args:
+        hierarchy_nodes (list): Hierarchy node records from Cascade.
+
+    Returns:
+        dict: (L1, L2, L3, L4, L5, L6, payroll_name) for each node Id.
+    """
+    node_lookup = {node['Id']: node for node in hierarchy_nodes}
+    levels_by_node = {}
+
+    for node_id in node_lookup:
+        # Walk up until a resolved ancestor, a root, an orphan or a cycle
+        chain = []
+        seen = set()
+        current_id = node_id
+        while current_id in node_lookup and current_id not in levels_by_node and current_id not in seen:
+            seen.add(current_id)
+            chain.append(current_id)
+            current_id = node_lookup[current_id].get('ParentId')
+            if not current_id:
+                break
+
+        # Resolve back down the chain; ancestors win when two nodes share a level
+        parent_levels = levels_by_node.get(current_id, {})
+        for chain_id in reversed(chain):
+            node = node_lookup[chain_id]
+            levels = {node['Level']: node['Title']}
+            levels.update(parent_levels)
+            levels_by_node[chain_id] = levels
+            parent_levels = levels
+
+    # Payroll names for every node in one bulk classification
+    node_ids = list(node_lookup)
+    paths = [tuple(levels_by_node[node_id].get(level) for level in range(1, 7)) for node_id in node_ids]
+    levels = pd.DataFrame(paths, columns=["L1", "L2", "L3", "L4", "L5", "L6"], dtype=object)
+    payroll_names, rule_names = classify_payroll(levels)
+
+    hierarchy_table = {
+        node_id: path + (payroll_name,)
+        for node_id, path, payroll_name in zip(node_ids, paths, payroll_names)
     }
-    
-    for country, payroll in country_mapping.items():
-        if country in L2:
-            return payroll
-    
-    return "Unknown Payroll"
 
-def build_hierarchy_path(target_id):
-    # Create a lookup dictionary for fast node access by Id
-    node_lookup = {node['Id']: node for node in cascade_hierarchy_nodes}
-    
-    # Find the starting node
-    if target_id not in node_lookup:
-        return None, None, None, None, None, None, None
-    
-    current_node = node_lookup[target_id]
-    hierarchy = {}
-    
-    # Build the hierarchy by traversing up through parents
-    while current_node:
-        level = current_node['Level']
-        title = current_node['Title']
-        hierarchy[level] = title
-        
-        # Move to parent node
-        parent_id = current_node.get('ParentId')
-        if parent_id and parent_id in node_lookup:
-            current_node = node_lookup[parent_id]
-        else:
-            break
-    
-    # Return individual level values for all 6 levels
-    L1 = hierarchy.get(1)
-    L2 = hierarchy.get(2)
-    L3 = hierarchy.get(3)
-    L4 = hierarchy.get(4)
-    L5 = hierarchy.get(5)
-    L6 = hierarchy.get(6)
+    if data_export:
+        payroll_rules_fired = dict(zip(node_ids, rule_names))
+        export_data("001f - Cascade Hierarchy Paths.json", hierarchy_table_records(hierarchy_table, payroll_rules_fired))
 
-    payroll_name = determine_payroll(L2,L3,L4,L6)
+    return hierarchy_table
 
-    return L1, L2, L3, L4, L5, L6, payroll_name
+hierarchy_columns = [f"Hierarchy Level {level}" for level in range(1, 7)] + ["Payroll Name"]
 
-def rearrange_cascade(cascade_responses,cascade_jobs):
-    rearranged = []
-    for record in cascade_responses:
-        displayId = record["DisplayId"]
-        knownAs = record["KnownAs"]
-        surname = record["LastName"]
-        nationalInsurance = record["NationalInsuranceNumber"]
-        
-        contServiceDateStr = record["ContinuousServiceDate"]
-        contServiceDate = datetime.strptime(contServiceDateStr, '%Y-%m-%dT%H:%M:%SZ')
-        contServiceDate = contServiceDate.strftime('%d/%m/%Y')
-     
-        contractEndDateStr = record["EmploymentLeftDate"]
-        if contractEndDateStr is not None:
-            contractEndDate = datetime.strptime(contractEndDateStr, '%Y-%m-%dT%H:%M:%SZ')
-            contractEndDate = contractEndDate.strftime('%d/%m/%Y')
-        else:
-            contractEndDate = None
-
-        for job in cascade_jobs:
-            if record["Id"] == job["EmployeeId"]:
-                jobTitle = job.get("JobTitle","")
-                hierarchyId = job["HierarchyNodeId"]
-                H1,H2,H3,H4,H5,H6,payroll_name = build_hierarchy_path(hierarchyId)
-
-        transformed_record = {
-            "Display Id": displayId,
-            "Known As": knownAs,
-            "Surname": surname,
-            "Job Title": jobTitle,
-            "Hierarchy Level 1": H1,
-            "Hierarchy Level 2": H2,
-            "Hierarchy Level 3": H3,
-            "Hierarchy Level 4": H4,
-            "Hierarchy Level 5": H5,
-            "Hierarchy Level 6": H6,
-            "Payroll Name": payroll_name,           
-            "Cont. Service Date": contServiceDate,
-            "National Insurance No.": nationalInsurance,
-            "Contract End Date": contractEndDate,
+def hierarchy_table_records(hierarchy_table, payroll_rules_fired=None):
+    payroll_rules_fired = payroll_rules_fired or {}
+    return [
+        {
+            "Hierarchy Node Id": node_id,
+            **dict(zip(hierarchy_columns, path)),
+            "Payroll Rule": payroll_rules_fired.get(node_id),
         }
+        for node_id, path in hierarchy_table.items()
+    ]
 
-        rearranged.append(transformed_record)
-    if data_export:
-        export_data("001e - Cascade rearranged.json", rearranged)    
-    return rearranged
+def job_rank(job):
+    # Open-ended jobs outrank ended ones, then the latest end date and start date win
+    end_date = job.get("EndDate")
+    return (end_date is None, end_date or "", job.get("StartDate") or "")
 
-def time_difference(start, end):
-    # Check if either parameter is None
-    if start is None or end is None:
-        return None,None
-    
-    date_of_birth = datetime.fromisoformat(start.replace('Z', '+00:00'))
-    last_working_date = datetime.fromisoformat(end.replace('Z', '+00:00'))
-    
-    # Calculate years
-    years = last_working_date.year - date_of_birth.year
-    
-    # Calculate months
-    months = last_working_date.month - date_of_birth.month
-    
-    # Adjust if the day hasn't been reached yet in the current month
-    if last_working_date.day < date_of_birth.day:
-        months -= 1
-    
-    # Adjust if months is negative
-    if months < 0:
-        years -= 1
-        months += 12
-    
-    return years, months
+def index_current_jobs(cascade_jobs):
+    """
+    Pick one current job per employee in a single pass over the jobs list.
 
-def find_line_manager(ID, cascade_jobs, cascade_responses):
-    LM_ID = None
-    line_manager = None
-    
-    # Find the line manager ID
+    Args:
+        cascade_jobs (list): Job records from Cascade.
+
+    Returns:
+        dict: The chosen job for each EmployeeId. Ties on job_rank go to the
+        job that appears later in the list.
+    """
+    current_jobs = {}
     for job in cascade_jobs:
-        if job["EmployeeId"] == ID:
-            LM_ID = job["LineManagerId"]
-            break  # Exit once found
-    
-    # If no line manager ID was found, return None values
+        employee_id = job["EmployeeId"]
+        existing = current_jobs.get(employee_id)
+        if existing is None or job_rank(job) >= job_rank(existing):
+            current_jobs[employee_id] = job
+    return current_jobs
+
+def job_intervals(cascade_jobs):
+    # Start and end dates of every job as datetime64, so current jobs can be picked at any date
+    frame = pd.DataFrame.from_records(cascade_jobs, columns=["EmployeeId", "StartDate", "EndDate"])
+    return {
+        "employee_ids": frame["EmployeeId"].tolist(),
+        "start": parse_dates(frame["StartDate"]).to_numpy(dtype="datetime64[D]"),
+        "end": parse_dates(frame["EndDate"]).to_numpy(dtype="datetime64[D]"),
+    }
+
+def jobs_as_of(intervals, cascade_jobs, as_of):
+    """
+    Pick each employee's job at a past date, the way index_current_jobs picks it today.
+
+    Jobs that had started by `as_of` outrank later ones, then jobs still in
+    effect on `as_of` (no end date or ending on or after it), then job_rank
+    on the dates. Dates are compared by day.
+
+    Args:
+        intervals (dict): Output of job_intervals for `cascade_jobs`.
+        cascade_jobs (list): Job records from Cascade.
+        as_of (date): The date to pick jobs at.
+
+    Returns:
+        dict: The chosen job for each EmployeeId. Ties go to the job that
+        appears later in the list.
+    """
+    as_of = np.datetime64(as_of, "D")
+    start, end = intervals["start"], intervals["end"]
+    open_ended = np.isnat(end)
+
+    # NaT is the smallest int64, so missing dates rank lowest, as "" does in job_rank
+    order = np.lexsort((
+        np.arange(len(cascade_jobs)),
+        start.astype("int64"),
+        end.astype("int64"),
+        open_ended,
+        open_ended | (end >= as_of),
+        np.isnat(start) | (start <= as_of),
+    ))
+
+    # Later (higher ranked) jobs overwrite earlier ones
+    employee_ids = intervals["employee_ids"]
+    return {employee_ids[i]: cascade_jobs[i] for i in order.tolist()}
+
+def period_membership(records, as_of_dates):
+    """
+    Headcount and leaver membership of every employee at every month-end in one pass.
+
+    Start and left dates are parsed once and compared against all the
+    month-ends together: an employee is in the headcount if they started on
+    or before the month-end and had not left before it, and a leaver if they
+    left between the start of that year and the month-end. As in
+    headcount_window and leaver_window, timestamps are compared to the
+    second against midnight at the start of each month-end, so someone who
+    left later on a month-end day is in post rather than a leaver.
+
+    Args:
+        records (list): Employee records from Cascade.
+        as_of_dates (list): The month-ends to report on.
+
+    Returns:
+        tuple: (in_headcount, is_leaver), boolean arrays of shape
+        (employees, month-ends).
+    """
+    frame = pd.DataFrame.from_records(records, columns=["EmploymentStartDate", "EmploymentLeftDate"])
+    start = parse_timestamps(frame["EmploymentStartDate"]).to_numpy(dtype="datetime64[s]")[:, None]
+    left = parse_timestamps(frame["EmploymentLeftDate"]).to_numpy(dtype="datetime64[s]")[:, None]
+
+    as_of = np.array(as_of_dates, dtype="datetime64[D]")[None, :]
+    year_start = as_of.astype("datetime64[Y]").astype("datetime64[s]")
+    as_of = as_of.astype("datetime64[s]")
+
+    # Comparisons with NaT are always False, so a missing start date is never in post
+    not_left = np.isnat(left) | (left >= as_of)
+    in_headcount = (start <= as_of) & not_left
+    is_leaver = (left >= year_start) & (left <= as_of)
+    return in_headcount, is_leaver
+
+def index_employees(cascade_responses):
+    return {record["Id"]: record for record in cascade_responses}
+
+def remember_employees(cascade_responses, employees):
+    # Keep only the fields the line manager lookup needs as records stream past
+    for record in cascade_responses:
+        employees.append({key: record.get(key) for key in ("Id", "DisplayId", "KnownAs", "LastName")})
+        yield record
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def parse_dates(values):
+    # Cascade ISO timestamps -> datetime64; the reports only ever show the date part
+    return pd.to_datetime(values.str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+
+def parse_timestamps(values):
+    # The first 19 characters, as the window tests read them, so "Z", "+00:00" and fractions are ignored
+    return pd.to_datetime(values.str.slice(0, 19), format='ISO8601', errors='coerce')
+
+def parse_ids(values):
+    # Non-integral ids become blank, as pd.to_numeric(errors='coerce') into Int64 would leave them
+    numbers = pd.to_numeric(values, errors='coerce')
+    return numbers.where(numbers % 1 == 0).astype('Int64')
+
+def job_frame(current_jobs):
+    """
+    Job title, hierarchy levels and payroll name for every employee with a job.
+
+    Args:
+        current_jobs (dict): The chosen job for each EmployeeId.
+
+    Returns:
+        DataFrame: Indexed by EmployeeId, ready to be aligned to a chunk of employees.
+    """
+    hierarchy = pd.DataFrame.from_dict(cascade_hierarchy_table, orient="index", columns=hierarchy_columns)
+    node_ids = [job["HierarchyNodeId"] for job in current_jobs.values()]
+
+    jobs = hierarchy.reindex(node_ids)
+    jobs.index = pd.Index(list(current_jobs), name="EmployeeId")
+    jobs.insert(0, "Job Title", [job.get("JobTitle","") for job in current_jobs.values()])
+    return jobs
+
+def frame_rows(frame):
+    # Blank cells (NaN, NaT, <NA>) come out as None, like the row-by-row transform gave
+    columns = list(frame.columns)
+    values = [column_values(frame[column]) for column in columns]
+    for row in zip(*values):
+        yield dict(zip(columns, row))
+
+def column_values(column):
+    if pd.api.types.is_datetime64_dtype(column):
+        # numpy turns datetime64[us] into datetime objects (NaT into None) far faster than pandas
+        return column.to_numpy(dtype="datetime64[us]").astype(object).tolist()
+    return column.astype(object).where(column.notna(), None).tolist()
+
+def rearrange_cascade(cascade_responses,cascade_jobs,current_jobs=None):
+    # Records are transformed a chunk at a time as the caller reads them
+    if current_jobs is None:
+        current_jobs = index_current_jobs(cascade_jobs)
+    jobs = job_frame(current_jobs)
+    rearranged = (
+        row
+        for chunk in chunked(cascade_responses, cascade_chunk_size)
+        for row in frame_rows(transform_cascade(chunk, jobs))
+    )
+    return export_stream("001e - Cascade rearranged.json", rearranged)
+
+def transform_cascade(records, jobs):
+    """
+    Build the headcount rows for a chunk of employee records in one vectorized pass.
+
+    Dates are parsed once into datetime64 columns and Display Id into Int64,
+    so the Excel export needs no further conversion.
+
+    Args:
+        records (list): Employee records from Cascade.
+        jobs (DataFrame): Output of job_frame.
+
+    Returns:
+        DataFrame: One row per employee, in the headcount report's column order.
+    """
+    frame = pd.DataFrame.from_records(records, columns=[
+        "Id", "DisplayId", "KnownAs", "LastName", "NationalInsuranceNumber",
+        "ContinuousServiceDate", "EmploymentLeftDate",
+    ])
+    employee_jobs = jobs.reindex(frame["Id"])
+
+    return pd.DataFrame({
+        "Display Id": parse_ids(frame["DisplayId"]),
+        "Known As": frame["KnownAs"],
+        "Surname": frame["LastName"],
+        "Job Title": employee_jobs["Job Title"].to_numpy(),
+        **{column: employee_jobs[column].to_numpy() for column in hierarchy_columns[:6]},
+        "Payroll Name": employee_jobs["Payroll Name"].to_numpy(),
+        "Cont. Service Date": parse_dates(frame["ContinuousServiceDate"]),
+        "National Insurance No.": frame["NationalInsuranceNumber"],
+        "Contract End Date": parse_dates(frame["EmploymentLeftDate"]),
+    })
+
+def time_differences(start, end):
+    """
+    Whole years and months between two date columns.
+
+    Uses the same month-boundary rules as counting birthdays: a month only
+    counts once the day of the month in `end` has reached the day in
+    `start`, and a negative month count borrows a year.
+
+    Args:
+        start (Series): datetime64 dates from parse_dates, e.g. date of birth.
+        end (Series): datetime64 dates from parse_dates, e.g. the leave date.
+
+    Returns:
+        tuple: (years, months) as Int64 Series, blank where either date is missing.
+    """
+    years = end.dt.year - start.dt.year
+    months = end.dt.month - start.dt.month - (end.dt.day < start.dt.day)
+
+    borrow = months < 0
+    years = years - borrow
+    months = months + 12 * borrow
+
+    return years.astype("Int64"), months.astype("Int64")
+
+def format_duration(years, months):
+    # Missing values read "None", as the f-string in the row-by-row version gave
+    as_text = lambda values: values.astype(object).fillna("None").astype(str)
+    return as_text(years) + " Yrs " + as_text(months) + " Mths"
+
+def find_line_manager(ID, current_jobs, employees_by_id):
+    # Find the line manager ID from the employee's current job
+    job = current_jobs.get(ID)
+    LM_ID = job.get("LineManagerId") if job else None
+
+    # If no line manager ID was found, return None
     if LM_ID is None:
-        return None, None
-    
+        return None
+
     # Find the line manager details
-    for record in cascade_responses:
-        if record["Id"] == LM_ID:
-            lm_known_as = record["KnownAs"]
-            lm_surname = record["LastName"]
-            lm_id = record["DisplayId"]
-            line_manager = f"({lm_id}) {lm_known_as} {lm_surname}"
-            break  # Exit once found
-    
-    # If line manager wasn't found in cascade_responses, use API
-    if line_manager is None:
-        api_url = f"https://api.iris.co.uk/hr/v2/employees/{LM_ID}"
-        api_response = api_call_cascade(cascade_token, api_url, None)
-        
-        if api_response.status_code == 200:
-            json_data = api_response.json()
-            # Format the API response to match expected format
-            lm_known_as = json_data.get("KnownAs", "")
-            lm_surname = json_data.get("LastName", "")
-            lm_id = json_data.get("DisplayId", "")
-            line_manager = f"({lm_id}) {lm_known_as} {lm_surname}"
-    
+    record = employees_by_id.get(LM_ID)
+    if record is not None:
+        return format_line_manager(record)
+
+    # Managers outside the headcount are normally cached by fetch_line_managers
+    if LM_ID in line_manager_cache:
+        return line_manager_cache[LM_ID]
+
+    # If line manager wasn't found in cascade_responses or the cache, use API
+    line_manager = None
+    api_url = f"{cascade_api_base}/hr/v2/employees/{LM_ID}"
+    api_response = api_call_cascade(cascade_token, api_url, None)
+
+    if api_response.status_code == 200:
+        line_manager = format_line_manager(api_response.json())
+    if api_response.status_code in (200, 404):
+        line_manager_cache[LM_ID] = line_manager
+
     return line_manager
 
-def rearrange_leavers(cascade_responses,cascade_leavers,cascade_jobs):
-    rearranged = []
-    for record in cascade_leavers:
-        id = record["Id"]
-        displayId = record["DisplayId"]
-        surname = record["LastName"]
-        knownAs = record["KnownAs"]
-        leaver_reason = record["LeaverReason"]        
-        dob = record["DateOfBirth"]
-
-        StartDateStr = record["EmploymentStartDate"]
-        StartDate = datetime.strptime(StartDateStr, '%Y-%m-%dT%H:%M:%SZ')
-        StartDate = StartDate.strftime('%d/%m/%Y')
-
-        leaver_date_str = record["EmploymentLeftDate"]
-        leaver_date = datetime.strptime(leaver_date_str, '%Y-%m-%dT%H:%M:%SZ')
-        leaver_date = leaver_date.strftime('%d/%m/%Y')
-       
-        age_years,age_months = time_difference(dob,leaver_date_str)
-        los_years,los_months = time_difference(StartDateStr,leaver_date_str)
-        LOS_months = 12 * los_years + los_months
-        
-        for job in cascade_jobs:
-            if record["Id"] == job["EmployeeId"]:
-                jobTitle = job.get("JobTitle","")
-                hierarchyId = job["HierarchyNodeId"]
-                H1,H2,H3,H4,H5,H6,payroll_name = build_hierarchy_path(hierarchyId)
-
-        line_manager = find_line_manager(id, cascade_jobs,cascade_responses)
-        
-
-        transformed_record = {
-            "Employee Id": displayId,
-            "Surname": surname,
-            "Known As": knownAs,
-            "Leaver": "Yes",
-            "Leaver Reason": leaver_reason,
-            "Start Date": StartDate,
-            "Contract End Date": leaver_date,
-            "Hierarchy Level 3": H3,
-            "Hierarchy Level 4": H4,
-            "Hierarchy Level 5": H5,
-            "Works for": line_manager,
-            "Age": f"{age_years} Yrs {age_months} Mths",
-            "Length of Service":  f"{los_years} Yrs {los_months} Mths",
-            "LOS Months": LOS_months,
-            "Job Title": jobTitle,
-            "Payroll Name": payroll_name,           
+# Formatted line managers fetched from the API, shared for the whole run
+line_manager_cache = {}
+
+def fetch_line_managers(manager_ids):
+    """
+    Look up line managers who are not in the headcount, in batches.
 
+    Each batch is a single $filter=Id in (...) query, and the batches run on
+    the Cascade thread pool. Results go into line_manager_cache. Any Id the
+    batch query does not return is left for find_line_manager to fetch one
+    at a time.
+
+    Args:
+        manager_ids (iterable): LineManagerId values to resolve.
+    """
+    missing = [manager_id for manager_id in dict.fromkeys(manager_ids) if manager_id not in line_manager_cache]
+    batches = [missing[i:i + line_manager_batch_size] for i in range(0, len(missing), line_manager_batch_size)]
+
+    def fetch_batch(batch):
+        id_list = ",".join(f"'{manager_id}'" for manager_id in batch)
+        api_params = {
+            "$top": len(batch),
+            "$filter": f"Id in ({id_list})",
         }
+        api_response = api_call_cascade(cascade_token, cascade_workers_url, api_params)
 
-        rearranged.append(transformed_record)
-    
-    # After you've built your rearranged list, sort it
-    rearranged.sort(key=lambda x: x["Contract End Date"] if x["Contract End Date"] else "")
+        if api_response.status_code == 200:
+            for record in api_response.json()['value']:
+                line_manager_cache[record["Id"]] = format_line_manager(record)
+
+    with ThreadPoolExecutor(max_workers=cascade_page_workers) as executor:
+        list(executor.map(fetch_batch, batches))
+
+def format_line_manager(record):
+    lm_known_as = record.get("KnownAs", "")
+    lm_surname = record.get("LastName", "")
+    lm_id = record.get("DisplayId", "")
+    return f"({lm_id}) {lm_known_as} {lm_surname}"
+
+def rearrange_leavers(cascade_responses,cascade_leavers,cascade_jobs,current_jobs=None):
+    cascade_leavers = list(cascade_leavers)
+    if current_jobs is None:
+        current_jobs = index_current_jobs(cascade_jobs)
+    employees_by_id = index_employees(cascade_responses)
+
+    # Resolve every line manager outside the headcount up front, in batches
+    manager_ids = (
+        current_jobs[record["Id"]].get("LineManagerId")
+        for record in cascade_leavers if record["Id"] in current_jobs
+    )
+    fetch_line_managers(
+        manager_id for manager_id in manager_ids
+        if manager_id is not None and manager_id not in employees_by_id
+    )
 
+    frame = pd.DataFrame.from_records(cascade_leavers, columns=[
+        "Id", "DisplayId", "LastName", "KnownAs", "LeaverReason",
+        "DateOfBirth", "EmploymentStartDate", "EmploymentLeftDate",
+    ])
+    leaver_jobs = job_frame(current_jobs).reindex(frame["Id"])
+
+    # Each date column is parsed once and shared by the date fields and the durations
+    birth_date = parse_dates(frame["DateOfBirth"])
+    start_date = parse_dates(frame["EmploymentStartDate"])
+    leave_date = parse_dates(frame["EmploymentLeftDate"])
+
+    age_years, age_months = time_differences(birth_date, leave_date)
+    los_years, los_months = time_differences(start_date, leave_date)
+
+    rearranged = pd.DataFrame({
+        "Employee Id": parse_ids(frame["DisplayId"]),
+        "Surname": frame["LastName"],
+        "Known As": frame["KnownAs"],
+        "Leaver": "Yes",
+        "Leaver Reason": frame["LeaverReason"],
+        "Start Date": start_date,
+        "Contract End Date": leave_date,
+        "Hierarchy Level 3": leaver_jobs["Hierarchy Level 3"].to_numpy(),
+        "Hierarchy Level 4": leaver_jobs["Hierarchy Level 4"].to_numpy(),
+        "Hierarchy Level 5": leaver_jobs["Hierarchy Level 5"].to_numpy(),
+        "Works for": [find_line_manager(id, current_jobs, employees_by_id) for id in frame["Id"]],
+        "Age": format_duration(age_years, age_months),
+        "Length of Service": format_duration(los_years, los_months),
+        "LOS Months": 12 * los_years + los_months,
+        "Job Title": leaver_jobs["Job Title"].to_numpy(),
+        "Payroll Name": leaver_jobs["Payroll Name"].to_numpy(),
+    }, index=frame.index)
+
+    # Oldest leave date first; a stable sort keeps the API order for the same date
+    rearranged = rearranged.sort_values("Contract End Date", kind="stable", na_position="first")
+
+    rearranged = list(frame_rows(rearranged))
     if data_export:
-        export_data("002e - Leavers rearranged.json", rearranged)    
+        export_data("002e - Leavers rearranged.json", rearranged)
     return rearranged
 
 def status_type(status):
@@ -660,60 +1885,260 @@ def status_type(status):
     }
     return status_map.get(status)
 
-def GET_workers_adp(c):
+class AdpWorker:
+    """
+    The fields of an ADP worker the reports use, taken from its active
+    assignment (the last primary one, as find_active_job_position picks).
 
-    global adp_active_usa,adp_leave_usa,adp_all_usa
-    global adp_active_can,adp_leave_can,adp_all_can
+    Worker payloads are large and deeply nested, so each worker keeps eight
+    values in slots rather than the whole decoded tree. Fields missing from
+    the payload are None.
+    """
 
-    adp_active_usa = []
-    adp_leave_usa = []
-    adp_all_usa =[]
+    __slots__ = ("associate_oid", "worker_id", "name", "position_id", "status", "hire_date", "department_code", "department_name")
+
+    def __init__(self, associate_oid, worker_id, name, position_id, status, hire_date, department_code, department_name):
+        self.associate_oid = associate_oid
+        self.worker_id = worker_id
+        self.name = name
+        self.position_id = position_id
+        self.status = status
+        self.hire_date = hire_date
+        self.department_code = department_code
+        self.department_name = department_name
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+def compact_worker(worker):
+    # Dict payload (stdlib json) -> AdpWorker
+    work_assignments = worker.get("workAssignments") or [{}]
+    active_job_position = find_active_job_position(worker)
+    assignment = work_assignments[active_job_position] if active_job_position is not None else {}
+
+    units = assignment.get("homeOrganizationalUnits") or []
+    name_code = (units[1].get("nameCode") or {}) if len(units) > 1 else {}
+    short_name = name_code.get("shortName")
+
+    return AdpWorker(
+        worker.get("associateOID"),
+        (worker.get("workerID") or {}).get("idValue"),
+        ((worker.get("person") or {}).get("legalName") or {}).get("formattedName"),
+        assignment.get("positionID"),
+        ((assignment.get("assignmentStatus") or {}).get("statusCode") or {}).get("longName"),
+        assignment.get("hireDate"),
+        name_code.get("codeValue", ""),
+        short_name if short_name is not None else name_code.get("longName"),
+    )
 
-    adp_active_can = []
-    adp_leave_can = []
-    adp_all_can = []  
+if msgspec is not None:
+    # Only the fields AdpWorker needs are declared; msgspec skips the rest of the payload unparsed
+    class AdpNameCode(msgspec.Struct):
+        codeValue: Any = ""
+        shortName: Any = None
+        longName: Any = None
+
+    class AdpOrganizationalUnit(msgspec.Struct):
+        nameCode: AdpNameCode | None = None
+
+    class AdpStatusCode(msgspec.Struct):
+        longName: Any = None
+
+    class AdpAssignmentStatus(msgspec.Struct):
+        statusCode: AdpStatusCode | None = None
+
+    class AdpAssignment(msgspec.Struct):
+        primaryIndicator: Any = True
+        positionID: Any = None
+        hireDate: Any = None
+        assignmentStatus: AdpAssignmentStatus | None = None
+        homeOrganizationalUnits: list[AdpOrganizationalUnit] | None = None
+
+    class AdpLegalName(msgspec.Struct):
+        formattedName: Any = None
+
+    class AdpPerson(msgspec.Struct):
+        legalName: AdpLegalName | None = None
+
+    class AdpWorkerID(msgspec.Struct):
+        idValue: Any = None
+
+    class AdpWorkerPayload(msgspec.Struct):
+        associateOID: Any = None
+        workerID: AdpWorkerID | None = None
+        person: AdpPerson | None = None
+        workAssignments: list[AdpAssignment] | None = None
+
+    class AdpMeta(msgspec.Struct):
+        totalNumber: Any = 0
+
+    class AdpPage(msgspec.Struct):
+        workers: list[AdpWorkerPayload] = []
+        meta: AdpMeta | None = None
+
+    adp_page_decoder = msgspec.json.Decoder(AdpPage)
+
+def compact_worker_payload(worker):
+    # msgspec payload -> AdpWorker, with the same choices as compact_worker
+    assignment = None
+    for candidate in worker.workAssignments or []:
+        if candidate.primaryIndicator:
+            assignment = candidate
+
+    units = (assignment.homeOrganizationalUnits or []) if assignment else []
+    name_code = units[1].nameCode if len(units) > 1 else None
+    status_code = assignment and assignment.assignmentStatus and assignment.assignmentStatus.statusCode
+
+    return AdpWorker(
+        worker.associateOID,
+        worker.workerID and worker.workerID.idValue,
+        worker.person and worker.person.legalName and worker.person.legalName.formattedName,
+        assignment and assignment.positionID,
+        status_code and status_code.longName,
+        assignment and assignment.hireDate,
+        name_code.codeValue if name_code else "",
+        (name_code.shortName if name_code.shortName is not None else name_code.longName) if name_code else None,
+    )
 
-    for status in ["active","leave"]:
-        print (f"       Downloading ADP Staff with the status - {status}")
-               
-        type = status_type (status)
-        page_size = 100
-        
-        adp_token = {"usa": adp_token_usa, "can": adp_token_can}[c]
+def decode_adp_page(content):
+    """
+    Decode a page of ADP workers straight into compact records.
 
-        api_headers = {
-            'Authorization': f'Bearer {adp_token}',
-            'Accept':"application/json;masked=false"
-            }
-        
-        api_calls = api_count_adp(page_size,adp_workers_url,api_headers,type)
-        for i in range(api_calls):
-            skip_param = i * page_size
-
-            api_response = api_call(page_size,skip_param,adp_workers_url,api_headers,type)
-
-            if api_response.status_code == 200:
-                json_data = api_response.json()
-                json_data = json_data['workers']
-           
-                filtered_data = [
-                    worker for worker in json_data 
-                    if worker.get('workerID', {}).get('idValue') not in strings_to_exclude
-                ]
-                    
-                globals()[f"adp_{status}_{c}"].extend(filtered_data)
-            else:
-                continue   
+    With msgspec installed, only the declared fields are parsed; otherwise
+    the page goes through the stdlib json module and is then trimmed.
 
-    adp_all = {
-        "usa": adp_active_usa + adp_leave_usa,
-        "can": adp_active_can + adp_leave_can,
-    }[c]
+    Args:
+        content (bytes): The response body.
 
-    if data_export:
-        export_data(f"003 - ADP all raw {c}.json", adp_all)
+    Returns:
+        tuple: (meta.totalNumber or 0, list of AdpWorker).
+    """
+    if msgspec is not None:
+        page = adp_page_decoder.decode(content)
+        return (page.meta.totalNumber if page.meta else 0), [compact_worker_payload(worker) for worker in page.workers]
 
-    return adp_all
+    json_data = json.loads(content)
+    return json_data.get("meta", {}).get("totalNumber", 0), [compact_worker(worker) for worker in json_data.get("workers", [])]
+
+def adp_page_workers_kept(content, excluded):
+    """
+    Decode one page of ADP workers and drop those on the exclusion list.
+
+    Args:
+        content (bytes): The response body.
+        excluded (ExclusionList): The ADP workerIDs to leave out.
+
+    Returns:
+        tuple: (meta.totalNumber, workers on the page before filtering,
+        list of (associateOID, AdpWorker)).
+    """
+    total_number, workers = decode_adp_page(content)
+    kept = [(worker.associate_oid, worker) for worker in workers if worker.worker_id not in excluded]
+    return total_number, len(workers), kept
+
+def adp_page_rows(content, excluded):
+    # Runs in a pool process: the same as adp_page_workers_kept, with each worker already rearranged
+    total_number, page_length, kept = adp_page_workers_kept(content, excluded)
+    return total_number, page_length, [(associate_id, transform_adp_staff(worker)) for associate_id, worker in kept]
+
+adp_process_pool = None
+adp_process_lock = threading.Lock()
+
+def adp_processes():
+    # Created on first use and shared by both countries; forkserver, because the
+    # stage scheduler's threads are already running when the pool starts
+    global adp_process_pool
+    with adp_process_lock:
+        if adp_process_pool is None:
+            adp_process_pool = ProcessPoolExecutor(
+                max_workers=adp_transform_processes,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+    return adp_process_pool
+
+def iterate_workers_adp(c, page_items=None):
+    """
+    Yield the active and on-leave ADP workers for one country as pages arrive.
+
+    Page 0 of each status is requested with count=true, so it gives both the
+    page count and the first page. The remaining pages are then fetched on a
+    thread pool through the country's pooled mTLS session, with only a few
+    pages held in memory at once. Workers come out in status then page order;
+    a worker seen twice because inserts shifted the $skip offsets is only
+    yielded once.
+
+    Args:
+        c (str): Country key, "usa" or "can".
+        page_items (callable): Turns a response body into (total number,
+            page length, [(associateOID, item)]). Defaults to
+            adp_page_workers_kept, so the items are AdpWorker records.
+
+    Yields:
+        tuple: (status, item) for every worker not on the exclusion list.
+    """
+    page_items = page_items or (lambda content: adp_page_workers_kept(content, adp_exclusions))
+    statuses = ["active","leave"]
+    page_size = 100
+
+    api_headers = {
+        'Accept':"application/json;masked=false"
+        }
+
+    def fetch_page(page):
+        status, i = page
+        api_response = api_call(page_size,i * page_size,adp_workers_url,api_headers,status_type(status),c,count=(i == 0))
+
+        # ADP answers 204 past the last page; anything else but 200 stops the run
+        if api_response.status_code == 204:
+            return 0, []
+        if api_response.status_code != 200:
+            raise Exception(f"❌ ADP {status} page {i} ({c}) failed ({api_response.status_code}): {api_response.text[:200]}")
+
+        total_number, page_length, items = page_items(api_response.content)
+        if i == 0:
+            api_calls[status] = api_count_adp(total_number,page_size)
+        return page_length, items
+
+    def first_page(status):
+        print (f"       Downloading ADP Staff with the status - {status} ({c})")
+        return fetch_page((status, 0))
+
+    def status_pages(executor, status, first):
+        yield first
+        page = first
+        pages = [(status, i) for i in range(1, api_calls.get(status, 0))]
+        for page in ordered_map(executor, fetch_page, pages, 2 * adp_page_workers):
+            yield page
+
+        # Records inserted during the run push the tail past the original count
+        i = max(api_calls.get(status, 0), 1)
+        while page[0] == page_size:
+            page = fetch_page((status, i))
+            yield page
+            i += 1
+
+    api_calls = {}
+    seen_ids = set()
+    with ThreadPoolExecutor(max_workers=adp_page_workers) as executor:
+        first_pages = list(executor.map(first_page, statuses))
+
+        for status, first in zip(statuses, first_pages):
+            for page_length, items in status_pages(executor, status, first):
+                run_metrics.count("records", page_length)
+                for associate_id, item in items:
+                    if associate_id is not None:
+                        if associate_id in seen_ids:
+                            continue
+                        seen_ids.add(associate_id)
+                    yield status, item
+
+def stream_workers_adp(c):
+    workers = (worker for status, worker in iterate_workers_adp(c))
+    return export_stream(f"003 - ADP workers {c}.json", workers)
+
+def replay_workers_adp(c):
+    # Workers from an earlier run's "003" export, rebuilt so rearrange_adp_staff can read them again
+    return (AdpWorker(**record) for record in read_export(export_path(f"003 - ADP workers {c}.json")))
 
 def find_active_job_position(worker):
     active_job_position = None
@@ -726,96 +2151,396 @@ def find_active_job_position(worker):
     return active_job_position
 
 def rearrange_adp_staff(data,c):
-    rearranged_usa = []
-    rearranged_can = []
-
-    target_list = rearranged_usa if c == "usa" else rearranged_can
-
-    for record in data:
-        active_job_position = find_active_job_position(record)
-
-        name = record["person"]["legalName"]["formattedName"]
-        position = record["workAssignments"][active_job_position]["positionID"]
-        status = record["workAssignments"][active_job_position]["assignmentStatus"]["statusCode"]["longName"]
-        hireDate = record["workAssignments"][active_job_position]["hireDate"]
-        departmentNumber = record["workAssignments"][active_job_position]["homeOrganizationalUnits"][1]["nameCode"].get("codeValue","")
-        departmentShortName = record["workAssignments"][active_job_position]["homeOrganizationalUnits"][1]["nameCode"].get("shortName",None)
-        departmentLongName = record["workAssignments"][active_job_position]["homeOrganizationalUnits"][1]["nameCode"].get("longName",None)
-
-        departmentName = departmentShortName if departmentShortName is not None else departmentLongName
-
-        transformed_record = {
-            "Name": name,
-            "Position ID": position,
-            "Employee Status": status,
-            "Hire Date": hireDate,
-            "Home Department": f"{departmentNumber} - {departmentName}"
-        }
+    # Records are transformed one at a time as the caller reads them
+    rearranged = (transform_adp_staff(record) for record in data)
+    return export_stream(f"003a - ADP rearranged - {c}.json", rearranged)
+
+def transform_adp_staff(record):
+    # The active assignment was picked when the page was decoded (see AdpWorker)
+    transformed_record = {
+        "Name": record.name,
+        "Position ID": record.position_id,
+        "Employee Status": record.status,
+        "Hire Date": record.hire_date,
+        "Home Department": f"{record.department_code} - {record.department_name}"
+    }
 
-        target_list.append(transformed_record)
+    return transformed_record
 
-    if data_export:
-        export_data(f"003a - ADP rearranged - {c}.json", target_list)
+#----------------
 
-    return target_list
+def to_int(value):
+    # Matches pd.to_numeric(errors='coerce') into Int64: anything non-integral becomes blank
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+def to_date(date_format):
+    def convert(value):
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            return None
+    convert.is_date = True
+    return convert
+
+class XlsxReport:
+    """
+    Single-sheet workbook written row by row with openpyxl's write-only mode.
 
-#----------------
+    The header is styled the way DataFrame.to_excel styles it, and dates are
+    written as real Excel dates.
+    """
 
-def export_to_excel_headcounts(rearranged_cascade):
-    df = pd.json_normalize(rearranged_cascade)
+    def __init__(self, file_path, columns, converters):
+        self.file_path = file_path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title="Sheet1")
+
+        thin = Side(style="thin")
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(self.sheet, value=column)
+            cell.font = Font(bold=True)
+            cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+            cell.alignment = Alignment(horizontal="center", vertical="top")
+            header.append(cell)
+        if header:
+            self.sheet.append(header)
+
+    def write(self, values):
+        cells = []
+        for value in values:
+            if isinstance(value, datetime):
+                cell = WriteOnlyCell(self.sheet, value=value)
+                cell.number_format = "YYYY-MM-DD HH:MM:SS"
+                value = cell
+            cells.append(value)
+        self.sheet.append(cells)
+
+    def close(self):
+        self.workbook.save(self.file_path)
+
+class CsvReport:
+    # Plain UTF-8 CSV; dates are written as YYYY-MM-DD and blanks as empty fields
+
+    def __init__(self, file_path, columns, converters):
+        self.outfile = open(file_path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.outfile)
+        self.writer.writerow(columns)
+
+    def write(self, values):
+        self.writer.writerow([value.strftime("%Y-%m-%d") if isinstance(value, datetime) else value for value in values])
+
+    def close(self):
+        self.outfile.close()
+
+class ParquetReport:
+    """
+    Parquet file written in row groups of batch_size rows.
 
-    df['Display Id'] = pd.to_numeric(df['Display Id'], errors='coerce').astype('Int64')
-    df['Cont. Service Date'] = pd.to_datetime(df['Cont. Service Date'], format='%d/%m/%Y', errors='coerce')
-    df['Contract End Date'] = pd.to_datetime(df['Contract End Date'], format='%d/%m/%Y', errors='coerce')
+    Columns with a to_int converter are int64 and those with a to_date
+    converter are timestamps; other column types come from the first batch,
+    with all-blank columns stored as strings.
+    """
 
-    df.to_excel(f"Data/Cascade Headcounts ({last_day_str}).xlsx", index=False)
+    batch_size = 10000
 
-def export_to_excel_leavers(rearranged_leavers):
-    df = pd.json_normalize(rearranged_leavers)
+    def __init__(self, file_path, columns, converters):
+        import pyarrow
 
-    df['Employee Id'] = pd.to_numeric(df['Employee Id'], errors='coerce').astype('Int64')
-    df['Start Date'] = pd.to_datetime(df['Start Date'], format='%d/%m/%Y', errors='coerce')
-    df['Contract End Date'] = pd.to_datetime(df['Contract End Date'], format='%d/%m/%Y', errors='coerce')
+        self.pa = pyarrow
+        self.file_path = file_path
+        self.columns = columns
+        self.known_types = {
+            column: pyarrow.int64() if converter is to_int else pyarrow.timestamp("us")
+            for column, converter in converters.items()
+            if converter is to_int or getattr(converter, "is_date", False)
+        }
+        self.batch = []
+        self.writer = None
+
+    def write(self, values):
+        self.batch.append(values)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow.parquet
+
+        columns = {column: [row[i] for row in self.batch] for i, column in enumerate(self.columns)}
+        if self.writer is None:
+            fields = []
+            for column, values in columns.items():
+                data_type = self.known_types.get(column) or self.pa.array(values).type
+                fields.append(self.pa.field(column, self.pa.string() if self.pa.types.is_null(data_type) else data_type))
+            self.writer = pyarrow.parquet.ParquetWriter(self.file_path, self.pa.schema(fields))
+
+        self.writer.write_table(self.pa.table(columns, schema=self.writer.schema))
+        self.batch = []
+
+    def close(self):
+        if self.batch or self.writer is None:
+            self.flush()
+        self.writer.close()
+
+report_writers = {
+    "xlsx": XlsxReport,
+    "csv": CsvReport,
+    "parquet": ParquetReport,
+}
+
+def export_report(name, rows, converters=None):
+    """
+    Write one report in every format in export_formats, in a single pass.
 
-    df.to_excel(f"Data/Cascade Leaver ({last_day_str}).xlsx", index=False)
+    Each row is converted once and handed to every writer, so the rows can
+    be a generator and memory stays flat whatever the report size.
 
-def export_to_excel_adp(data,c):
-    df = pd.json_normalize(data)
+    Args:
+        name (str): File name without extension, written under Data/.
+        rows (iterable): Dicts with the same keys, in column order.
+        converters (dict): Optional column name -> function applied to each value.
+    """
+    converters = converters or {}
+    rows = iter(rows)
+    first_row = next(rows, None)
+    columns = list(first_row) if first_row is not None else []
+
+    writers = [
+        report_writers[export_format](Path("Data") / f"{name}.{export_format}", columns, converters)
+        for export_format in export_formats
+    ]
 
-    df['Hire Date'] = pd.to_datetime(df['Hire Date'], format='%Y-%m-%d', errors='coerce')
+    rows_written = 0
+    if first_row is not None:
+        for row in itertools.chain([first_row], rows):
+            values = [converters[column](row.get(column)) if column in converters else row.get(column) for column in columns]
+            for writer in writers:
+                writer.write(values)
+            rows_written += 1
+    run_metrics.count("rows_written", rows_written)
+
+    for writer in writers:
+        writer.close()
+
+headcount_converters = {
+    'Display Id': to_int,
+    'Cont. Service Date': to_date('%d/%m/%Y'),
+    'Contract End Date': to_date('%d/%m/%Y'),
+}
+
+leaver_converters = {
+    'Employee Id': to_int,
+    'Start Date': to_date('%d/%m/%Y'),
+    'Contract End Date': to_date('%d/%m/%Y'),
+    'LOS Months': to_int,
+}
+
+adp_converters = {
+    'Hire Date': to_date('%Y-%m-%d'),
+}
+
+def export_to_excel_headcounts(rearranged_cascade, as_of_str=last_day_str):
+    export_report(f"Cascade Headcounts ({as_of_str})", rearranged_cascade, headcount_converters)
+
+def export_to_excel_leavers(rearranged_leavers, as_of_str=last_day_str):
+    export_report(f"Cascade Leaver ({as_of_str})", rearranged_leavers, leaver_converters)
+
+def stream_rows_adp(c):
+    # Pages go to the process pool as raw bytes and come back as report rows, in page order
+    def page_rows(content):
+        return adp_processes().submit(adp_page_rows, content, adp_exclusions).result()
+
+    rows = (row for status, row in iterate_workers_adp(c, page_rows))
+    return export_stream(f"003a - ADP rearranged - {c}.json", rows)
+
+def adp_report(c):
+    # ADP pages flow through filtering and rearranging straight into the report
+    if adp_transform_processes:
+        adp_rearranged = stream_rows_adp(c)
+    else:
+        adp_rearranged = rearrange_adp_staff(stream_workers_adp(c),c)
+    return f"ADP Data - {c} ({last_day_str})", adp_rearranged, adp_converters
 
-    df.to_excel(f"Data/ADP Data - {c} ({last_day_str}).xlsx", index=False)    
+#----------------
 
-if __name__ == "__main__":
-    countries = ["usa","can"]
-    #countries = ["usa"]
+def run_stages(stages, max_workers=8):
+    """
+    Run a graph of stages, each one as soon as all of its dependencies finish.
 
-    adp_tokens = {}
-    
-    creds, project_Id = google_auth()
+    Stages with no path between them run at the same time, so the total run
+    time tends to the slowest chain rather than the sum of every stage. If a
+    stage fails, the failure is reported and raised straight away: stages
+    not yet started are cancelled, and ones already running are not waited
+    for.
 
-    for c in countries:
-        client_id, client_secret, strings_to_exclude, country_hierarchy_USA, country_hierarchy_CAN, cascade_API_id, keyfile, certfile, service_acc = load_keys(c)
-        certfile, keyfile = load_ssl(certfile, keyfile)
-        adp_tokens[c] = adp_bearer(client_id,client_secret,certfile,keyfile)
-        
-        adp_token_usa = adp_tokens.get('usa')
-        adp_token_can = adp_tokens.get('can')
-        adp_all   = GET_workers_adp(c)
-        adp_rearranged = rearrange_adp_staff(adp_all,c)
-        export_to_excel_adp(adp_rearranged,c)
-    
-    cascade_token = cascade_bearer (cascade_API_id)
-    service_acc = json.loads(service_acc)
+    Args:
+        stages (dict): Stage name -> (function, list of dependency names).
+        max_workers (int): Most stages running at once.
 
-    #Current Headcount 
-    cascade_responses = GET_workers_cascade()
-    cascade_jobs = GET_jobs_cascade()
+    Returns:
+        dict: Stage name -> seconds it ran for.
+    """
+    for name, (fn, deps) in stages.items():
+        unknown = [dep for dep in deps if dep not in stages]
+        if unknown:
+            raise Exception(f"❌ Stage {name} depends on unknown stages {unknown}")
+
+    timings = {}
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while len(timings) < len(stages):
+            for name, (fn, deps) in stages.items():
+                if name not in timings and name not in running.values() and all(dep in timings for dep in deps):
+                    running[executor.submit(run_metrics.run_stage, name, fn)] = name
+
+            if not running:
+                raise Exception(f"❌ Stages {sorted(set(stages) - set(timings))} have circular dependencies")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    print (f"❌ Stage {name} failed: {error!r}")
+                    raise error
+                timings[name] = future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return timings
+
+def critical_path(stages, timings):
+    # The chain of dependent stages with the longest total run time
+    longest = {}
+
+    def chain(name):
+        if name not in longest:
+            deps = stages[name][1]
+            seconds, path = max((chain(dep) for dep in deps), key=lambda c: c[0], default=(0.0, []))
+            longest[name] = (seconds + timings[name], path + [name])
+        return longest[name]
+
+    return max((chain(name) for name in stages), key=lambda c: c[0])
+
+def report_stages(stages, timings, wall_time):
+    print ("")
+    print ("    Stage timings")
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print (f"        {name:<20} {seconds:8.1f}s")
+
+    seconds, path = critical_path(stages, timings)
+    print (f"    Critical path: {' -> '.join(path)} ({seconds:.1f}s of {wall_time:.1f}s wall time)")
+
+def stage_google_auth():
+    global creds, project_Id
+    if secrets_backend == "gcp":
+        creds, project_Id = google_auth()
+
+def stage_adp_setup(c):
+    global adp_exclusions
+    client_id, client_secret, strings_to_exclude, country_hierarchy_USA, country_hierarchy_CAN, cascade_API_id, keyfile, certfile, service_acc = load_keys(c)
+    adp_exclusions = ExclusionList.parse(strings_to_exclude)
+    print (f"    Excluding {adp_exclusions} from ADP ({c})")
+    certfile, keyfile = load_ssl(certfile, keyfile)
+    adp_connect(c, certfile, keyfile)
+    adp_tokens[c] = adp_bearer(client_id,client_secret,c)
+
+def stage_adp_export(c):
+    export_report(*adp_report(c))
+
+def stage_cascade_setup():
+    global cascade_token, cascade_exclusions
+    cascade_token = cascade_bearer (get_secret("cascade_API_id"))
+    cascade_exclusions = ExclusionList.parse(get_secret("cascadeId_to_drop"))
+    print (f"    Excluding {cascade_exclusions} from Cascade")
+
+def stage_cascade_jobs(as_of=None):
+    global cascade_jobs
+    cascade_jobs = GET_jobs_cascade(as_of)
+
+def stage_cascade_hierarchy():
+    global cascade_hierarchy_nodes, cascade_hierarchy_table
     cascade_hierarchy_nodes = GET_hierarchy_cascade()
+    cascade_hierarchy_table = build_hierarchy_table(cascade_hierarchy_nodes)
+
+def stage_cascade_headcount():
+    # Employees stream straight to the report; only what the leavers need is kept.
+    # The same sweep collects this year's leavers, so the leavers stage needs no download
+    global cascade_employees, cascade_leaver_records
+    cascade_employees = []
+    cascade_leaver_records = []
+    cascade_responses = remember_employees(GET_employees_cascade(cascade_leaver_records), cascade_employees)
     rearranged_cascade = rearrange_cascade(cascade_responses,cascade_jobs)
     export_to_excel_headcounts(rearranged_cascade)
 
-    #Leavers
-    cascade_leavers = GET_leavers_cascade()
-    rearranged_leavers = rearrange_leavers(cascade_responses,cascade_leavers,cascade_jobs)
+def stage_cascade_leavers():
+    cascade_leavers = export_stream("002b - Cascade Leavers Filtered.json", cascade_leaver_records)
+    rearranged_leavers = rearrange_leavers(cascade_employees,cascade_leavers,cascade_jobs)
     export_to_excel_leavers(rearranged_leavers)
+
+def stage_cascade_backfill():
+    # One download covers every period; each month-end's reports are then cut from it locally
+    records = GET_employees_backfill(backfill_dates)
+    in_headcount, is_leaver = period_membership(records, backfill_dates)
+    intervals = job_intervals(cascade_jobs)
+
+    for period, as_of in enumerate(backfill_dates):
+        as_of_str = as_of.strftime("%Y-%m-%d")
+        current_jobs = jobs_as_of(intervals, cascade_jobs, as_of)
+        headcount = [records[i] for i in np.flatnonzero(in_headcount[:, period]).tolist()]
+        leavers = [records[i] for i in np.flatnonzero(is_leaver[:, period]).tolist()]
+        print (f"    {as_of_str}: {len(headcount)} in post, {len(leavers)} leavers this year")
+
+        export_to_excel_headcounts(rearrange_cascade(headcount,cascade_jobs,current_jobs), as_of_str)
+        export_to_excel_leavers(rearrange_leavers(headcount,leavers,cascade_jobs,current_jobs), as_of_str)
+
+def backfill_stages():
+    # Cascade only: ADP has no history to report past month-ends from
+    return {
+        "google_auth": (stage_google_auth, []),
+        "cascade_setup": (stage_cascade_setup, ["google_auth"]),
+        "cascade_jobs": (partial(stage_cascade_jobs, backfill_dates[0]), ["cascade_setup"]),
+        "cascade_hierarchy": (stage_cascade_hierarchy, ["cascade_setup"]),
+        "cascade_backfill": (stage_cascade_backfill, ["cascade_jobs", "cascade_hierarchy"]),
+    }
+
+def pipeline_stages(countries):
+    # ADP and Cascade share nothing but the Google credentials, so the two sides overlap
+    stages = {"google_auth": (stage_google_auth, [])}
+
+    for c in countries:
+        stages[f"adp_setup_{c}"] = (partial(stage_adp_setup, c), ["google_auth"])
+        stages[f"adp_export_{c}"] = (partial(stage_adp_export, c), [f"adp_setup_{c}"])
+
+    stages.update({
+        "cascade_setup": (stage_cascade_setup, ["google_auth"]),
+        "cascade_jobs": (stage_cascade_jobs, ["cascade_setup"]),
+        "cascade_hierarchy": (stage_cascade_hierarchy, ["cascade_setup"]),
+        "cascade_headcount": (stage_cascade_headcount, ["cascade_jobs", "cascade_hierarchy"]),
+        "cascade_leavers": (stage_cascade_leavers, ["cascade_headcount"]),
+    })
+    return stages
+
+if __name__ == "__main__":
+    countries = ["usa","can"]
+    #countries = ["usa"]
+
+    print_banner()
+    stages = backfill_stages() if backfill_dates else pipeline_stages(countries)
+    if http_cache_mode == "resume":
+        prune_checkpoints()
+
+    started = time.perf_counter()
+    timings = run_stages(stages)
+    report_stages(stages, timings, time.perf_counter() - started)
+    export_metrics()
+
+    if http_cache_mode == "resume":
+        clear_checkpoints()